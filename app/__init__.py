@@ -9,9 +9,11 @@ def create_app(config_class=Config):
     # Register blueprints
     from app.routes.twilio_routes import twilio_bp
     from app.routes.api_routes import api_bp
+    from app.routes.admin_routes import admin_bp
     
     app.register_blueprint(twilio_bp)
     app.register_blueprint(api_bp)
+    app.register_blueprint(admin_bp)
     
     @app.route('/health', methods=['GET'])
     def health_check():
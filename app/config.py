@@ -29,4 +29,77 @@ class Config:
     AWS_S3_BUCKET = os.getenv('AWS_S3_BUCKET', 'kooler-agent-tts')
     AWS_REGION = os.getenv('AWS_REGION', 'us-west-2')
 
+    # Speculative processing of partial speech results
+    SPECULATIVE_PROCESSING = os.getenv('SPECULATIVE_PROCESSING', 'false').lower() == 'true'
+    SPECULATION_STABLE_MS = int(os.getenv('SPECULATION_STABLE_MS', '400'))
+    SPECULATION_MIN_WORDS = int(os.getenv('SPECULATION_MIN_WORDS', '3'))
 
+    # Per-turn latency budgets in seconds
+    VOICE_TURN_BUDGET = float(os.getenv('VOICE_TURN_BUDGET', '8'))
+    SMS_TURN_BUDGET = float(os.getenv('SMS_TURN_BUDGET', '12'))
+    API_TURN_BUDGET = float(os.getenv('API_TURN_BUDGET', '20'))
+
+    # Circuit breakers around upstream dependencies
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '3'))
+    BREAKER_RESET_SECONDS = float(os.getenv('BREAKER_RESET_SECONDS', '30'))
+    BREAKER_SLOW_CALL_SECONDS = {
+        'assistants': float(os.getenv('BREAKER_SLOW_ASSISTANTS', '5')),
+        'tts': float(os.getenv('BREAKER_SLOW_TTS', '5')),
+        'whisper': float(os.getenv('BREAKER_SLOW_WHISPER', '15')),
+        's3': float(os.getenv('BREAKER_SLOW_S3', '3')),
+        'chat': float(os.getenv('BREAKER_SLOW_CHAT', '5')),
+        'embeddings': float(os.getenv('BREAKER_SLOW_EMBEDDINGS', '2'))
+    }
+
+    # Conversation backend: 'assistants' (OpenAI threads) or 'local' (local history)
+    CONVERSATION_BACKEND = os.getenv('CONVERSATION_BACKEND', 'assistants')
+    LOCAL_CHAT_MODEL = os.getenv('LOCAL_CHAT_MODEL', 'gpt-4o-mini')
+    HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '1200'))
+    HISTORY_MAX_SESSIONS = int(os.getenv('HISTORY_MAX_SESSIONS', '1000'))
+
+    # TTS single-flight rendering
+    TTS_RENDER_LOCK_SECONDS = float(os.getenv('TTS_RENDER_LOCK_SECONDS', '15'))
+    TTS_NEGATIVE_CACHE_SECONDS = float(os.getenv('TTS_NEGATIVE_CACHE_SECONDS', '10'))
+
+    # OpenAI rate limits per model (requests and tokens per minute)
+    OPENAI_RATE_LIMITS = {
+        'assistants': {'rpm': int(os.getenv('OPENAI_RPM_ASSISTANTS', '500')), 'tpm': int(os.getenv('OPENAI_TPM_ASSISTANTS', '30000'))},
+        LOCAL_CHAT_MODEL: {'rpm': int(os.getenv('OPENAI_RPM_CHAT', '500')), 'tpm': int(os.getenv('OPENAI_TPM_CHAT', '200000'))},
+        'tts-1-hd': {'rpm': int(os.getenv('OPENAI_RPM_TTS', '500'))},
+        'whisper-1': {'rpm': int(os.getenv('OPENAI_RPM_WHISPER', '500'))},
+        'text-embedding-3-small': {'rpm': int(os.getenv('OPENAI_RPM_EMBEDDINGS', '3000')), 'tpm': int(os.getenv('OPENAI_TPM_EMBEDDINGS', '1000000'))}
+    }
+    ASSISTANT_RUN_TOKEN_ESTIMATE = int(os.getenv('ASSISTANT_RUN_TOKEN_ESTIMATE', '2000'))
+    LOCAL_COMPLETION_TOKEN_ESTIMATE = int(os.getenv('LOCAL_COMPLETION_TOKEN_ESTIMATE', '150'))
+    RATE_LIMIT_RESERVE = float(os.getenv('RATE_LIMIT_RESERVE', '0.2'))
+    # Retries for 429s, connection errors and 5xx responses
+    RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', '2'))
+
+    # Per-call profiling
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+    PROFILE_BUFFER_SIZE = int(os.getenv('PROFILE_BUFFER_SIZE', '50'))
+    PROFILE_MAX_EVENTS = int(os.getenv('PROFILE_MAX_EVENTS', '2000'))
+    PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '120'))
+    PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '10'))
+
+    # Semantic answer cache for non-personalized questions
+    SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+    SEMANTIC_CACHE_EMBEDDING_MODEL = os.getenv('SEMANTIC_CACHE_EMBEDDING_MODEL', 'text-embedding-3-small')
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.92'))
+    SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv('SEMANTIC_CACHE_TTL_SECONDS', '86400'))
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '500'))
+
+    # Chunked voice memo transcription; decoding Twilio media needs ffmpeg on the host,
+    # without it memos are sent to Whisper whole
+    TRANSCRIPTION_SAMPLE_RATE = int(os.getenv('TRANSCRIPTION_SAMPLE_RATE', '16000'))
+    TRANSCRIPTION_SEGMENT_MS = int(os.getenv('TRANSCRIPTION_SEGMENT_MS', '30000'))
+    TRANSCRIPTION_OVERLAP_MS = int(os.getenv('TRANSCRIPTION_OVERLAP_MS', '1000'))
+    TRANSCRIPTION_MIN_SILENCE_MS = int(os.getenv('TRANSCRIPTION_MIN_SILENCE_MS', '400'))
+    TRANSCRIPTION_SILENCE_DB = float(os.getenv('TRANSCRIPTION_SILENCE_DB', '16'))
+    TRANSCRIPTION_WORKERS = int(os.getenv('TRANSCRIPTION_WORKERS', '4'))
+
+    # Caller context prefetched on call arrival
+    PREFETCH_SLOT_DAYS = int(os.getenv('PREFETCH_SLOT_DAYS', '3'))
+    PREFETCH_WAIT_SECONDS = float(os.getenv('PREFETCH_WAIT_SECONDS', '1'))
+    PREFETCH_TTL_SECONDS = float(os.getenv('PREFETCH_TTL_SECONDS', '3600'))
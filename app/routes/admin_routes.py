@@ -0,0 +1,32 @@
+from flask import Blueprint, request, jsonify, Response
+from app.config import Config
+from app.services.profiling_service import list_profiles, get_profile, get_folded_stacks, get_trace_events
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+@admin_bp.before_request
+def require_admin_token():
+    """Admin endpoints are disabled unless ADMIN_TOKEN is set and supplied"""
+    if not Config.ADMIN_TOKEN or request.headers.get('X-Admin-Token') != Config.ADMIN_TOKEN:
+        return jsonify({"error": "Unauthorized"}), 401
+
+@admin_bp.route('/profiles', methods=['GET'])
+def profiles():
+    """List buffered call profiles"""
+    return jsonify(list_profiles())
+
+@admin_bp.route('/profiles/<call_sid>', methods=['GET'])
+def profile(call_sid):
+    """Timeline for a call as JSON, ?format=trace for Chrome trace events or ?format=folded for flamegraphs"""
+    output_format = request.args.get('format', 'json')
+    
+    if output_format == 'folded':
+        folded = get_folded_stacks(call_sid)
+        if folded is None:
+            return jsonify({"error": "Profile not found"}), 404
+        return Response(folded, mimetype='text/plain')
+    
+    data = get_trace_events(call_sid) if output_format == 'trace' else get_profile(call_sid)
+    if data is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify(data)
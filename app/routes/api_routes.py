@@ -1,5 +1,8 @@
 from flask import Blueprint, request, jsonify
 from app.services.conversation_service import process_conversation
+from app.services.speculation_service import get_speculation_stats
+from app.services.resilience_service import get_breaker_states
+from app.services.rate_limit_service import get_scheduler_stats
 from app.utils import logger
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
@@ -18,6 +21,21 @@ def chat_endpoint():
     
     return jsonify({"response": response})
 
+@api_bp.route('/speculation/stats', methods=['GET'])
+def speculation_stats():
+    """Hit and waste rates for speculative processing of partial speech"""
+    return jsonify(get_speculation_stats())
+
+@api_bp.route('/breakers', methods=['GET'])
+def breaker_states():
+    """Current state of the circuit breakers around upstream dependencies"""
+    return jsonify(get_breaker_states())
+
+@api_bp.route('/scheduler/stats', methods=['GET'])
+def scheduler_stats():
+    """Queue wait per priority class for outbound OpenAI requests"""
+    return jsonify(get_scheduler_stats())
+
 @api_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -3,14 +3,23 @@ import time
 import tempfile
 import threading
 import re
+import uuid
 import concurrent.futures
 from flask import Blueprint, request, Response, url_for
 from twilio.twiml.voice_response import VoiceResponse
 from twilio.twiml.messaging_response import MessagingResponse
-import openai
-from app.services.conversation_service import process_conversation
-from app.services.tts_service import get_cached_tts
-from app.utils import timer_decorator, logger
+from app.services.conversation_service import process_conversation, adopt_session, SESSION_STORE
+from app.services.assistant_service import FALLBACK_RESPONSES
+from app.services.tts_service import get_cached_tts, register_prerendered_tts
+from app.services.resilience_service import Deadline
+from app.services.rate_limit_service import PRIORITY_VOICE, PRIORITY_SPECULATIVE
+from app.services.transcription_service import transcribe_audio_file
+from app.services.speculation_service import observe_partial, claim_speculation
+from app.services.semantic_cache_service import get_cached_audio, attach_audio
+from app.services.caller_context_service import start_caller_prefetch
+from app.config import Config
+from app.services.profiling_service import should_profile, start_profile, record_event
+from app.utils import timer_decorator, logger, bind_call_sid, get_call_sid, run_with_call_sid
 
 # Caches for in-progress responses
 RESPONSE_CACHE = {}  # Cache for in-progress responses
@@ -18,6 +27,23 @@ CHUNK_CACHE = {}  # Cache for response chunks
 
 twilio_bp = Blueprint('twilio', __name__, url_prefix='/twilio')
 
+@twilio_bp.before_request
+def bind_call():
+    """Attach the CallSid to log lines and start profiling on call arrival when requested"""
+    call_sid = request.form.get('CallSid') or request.args.get('call_sid')
+    bind_call_sid(call_sid)
+    
+    if call_sid and request.endpoint == 'twilio.voice_webhook':
+        enabled, sample_stacks = should_profile(request.headers, request.args)
+        if enabled:
+            start_profile(call_sid, sample_stacks)
+    
+    record_event('webhook', path=request.path)
+
+@twilio_bp.teardown_request
+def unbind_call(exc):
+    bind_call_sid(None)
+
 def chunk_response(text, max_length=100):
     """Break response into smaller chunks at sentence boundaries"""
     if len(text) <= max_length:
@@ -41,32 +67,110 @@ def chunk_response(text, max_length=100):
     
     return chunks
 
-def process_and_respond(speech_result, call_sid):
-    """Process speech input and prepare response in background"""
+# Degraded answers are pre-rendered (see generate_greeting.py) so they play while TTS is down
+register_prerendered_tts([chunk for text in FALLBACK_RESPONSES.values() for chunk in chunk_response(text)], "nova")
+
+def prepare_response_audio(speech_result, session_id, deadline=None, priority=PRIORITY_VOICE):
+    """Run the assistant on a transcript and render the reply to audio segments"""
+    if deadline is None:
+        deadline = Deadline(Config.VOICE_TURN_BUDGET)
+    call_sid = get_call_sid()
+    
     # Process with AI assistant
-    ai_response = process_conversation(speech_result, mode='voice')
+    ai_response = process_conversation(speech_result, mode='voice', session_id=session_id, deadline=deadline, priority=priority)
+    
+    # Answers from the semantic cache come with their audio already rendered
+    segments = get_cached_audio(ai_response, "nova")
+    if segments is not None:
+        return segments
     
     # Break response into chunks
     chunks = chunk_response(ai_response)
     
-    # Process all chunks in parallel
-    s3_urls = []
+    # Process all chunks in parallel, keeping them in order
+    segments = [{"say": chunk} for chunk in chunks]
     with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-        future_to_chunk = {executor.submit(get_cached_tts, chunk, "nova"): chunk for chunk in chunks}
-        for future in concurrent.futures.as_completed(future_to_chunk):
+        future_to_index = {executor.submit(run_with_call_sid, call_sid, get_cached_tts, chunk, "nova", deadline, priority): i for i, chunk in enumerate(chunks)}
+        for future in concurrent.futures.as_completed(future_to_index):
             try:
                 s3_url = future.result()
                 if s3_url:
-                    s3_urls.append(s3_url)
+                    segments[future_to_index[future]] = {"url": s3_url}
             except Exception as e:
                 logger.error(f"Error processing chunk: {str(e)}")
     
+    if all("url" in segment for segment in segments):
+        attach_audio(ai_response, "nova", segments)
+    
+    # Chunks without audio fall back to Twilio's voice rather than silence
+    return segments
+
+def speculate_response_audio(speech_result, deadline):
+    """Speculative run on a partial transcript, queued behind live turns
+    
+    It runs in a scratch session so a wrong guess never reaches the call's
+    conversation, and returns the segments with the session the call adopts
+    on a hit.
+    """
+    scratch_id = f"speculative_{uuid.uuid4().hex}"
+    try:
+        segments = prepare_response_audio(speech_result, scratch_id, deadline, PRIORITY_SPECULATIVE)
+    finally:
+        scratch = SESSION_STORE.pop(scratch_id, {})
+    
+    # A run abandoned part way (e.g. before a caller-specific tool) can't be reused
+    if deadline.cancelled:
+        return None, scratch
+    return segments, scratch
+
+def process_and_respond(speech_result, call_sid, turn=None):
+    """Process speech input and prepare response in background"""
+    segments = None
+    
+    # Reuse the speculative run started from partial results if it matches
+    future = claim_speculation(call_sid, speech_result, turn)
+    if future is not None:
+        try:
+            segments, scratch = future.result()
+            # The speculative run answered the opening turn in its own session
+            if segments is not None:
+                adopt_session(call_sid, scratch)
+        except Exception as e:
+            logger.error(f"Error in speculative run: {str(e)}")
+    
+    if segments is None:
+        segments = prepare_response_audio(speech_result, call_sid)
+    
     # Store in cache for retrieval
-    RESPONSE_CACHE[call_sid] = s3_urls
+    RESPONSE_CACHE[call_sid] = segments
+
+def gather_speech(response):
+    """Add a speech gather, subscribing to partial results when speculation is enabled
+    
+    Each gather gets its own turn ID so partial results can be told apart
+    from those of the previous turn.
+    """
+    turn = uuid.uuid4().hex[:12]
+    options = {}
+    if Config.SPECULATIVE_PROCESSING:
+        options['partialResultCallback'] = f'/twilio/voice/partial?turn={turn}'
+        options['partialResultCallbackMethod'] = 'POST'
+    
+    return response.gather(
+        input='speech',
+        action=f'/twilio/voice/process?turn={turn}',
+        method='POST',
+        speechTimeout='auto',
+        speechModel='phone_call',
+        **options
+    )
 
 @twilio_bp.route('/voice', methods=['POST'])
 def voice_webhook():
     """Handle incoming voice calls from Twilio"""
+    # Load the caller's records and warm a thread while the greeting plays
+    start_caller_prefetch(request.form.get('CallSid'), request.form.get('From'))
+    
     response = VoiceResponse()
     
     # Initial greeting with minimal latency
@@ -75,21 +179,33 @@ def voice_webhook():
     response.play(greeting_url)  
     
     # Gather speech input
-    gather = response.gather(
-        input='speech',
-        action='/twilio/voice/process',
-        method='POST',
-        speechTimeout='auto',
-        speechModel='phone_call'
-    )
+    gather = gather_speech(response)
     
     return Response(str(response), mimetype='text/xml')
 
+@twilio_bp.route('/voice/partial', methods=['POST'])
+def voice_partial():
+    """Receive partial speech results and start speculative processing"""
+    call_sid = request.form.get('CallSid')
+    stable = request.form.get('StableSpeechResult', '')
+    unstable = request.form.get('UnstableSpeechResult', '')
+    transcript = f"{stable} {unstable}".strip()
+    
+    # Only the opening turn is speculated; later turns would need to read
+    # the conversation a guessed transcript must not write to
+    if SESSION_STORE.get(call_sid, {}).get('turns'):
+        return Response(status=204)
+    
+    observe_partial(call_sid, transcript, speculate_response_audio, request.args.get('turn'))
+    
+    return Response(status=204)
+
 @twilio_bp.route('/voice/process', methods=['POST'])
 def process_voice():
     """Process speech input from voice call"""
     speech_result = request.form.get('SpeechResult', '')
     call_sid = request.form.get('CallSid')
+    turn = request.args.get('turn')
     
     if not speech_result:
         response = VoiceResponse()
@@ -97,7 +213,7 @@ def process_voice():
         return Response(str(response), mimetype='text/xml')
     
     # Start background processing
-    threading.Thread(target=process_and_respond, args=(speech_result, call_sid)).start()
+    threading.Thread(target=run_with_call_sid, args=(call_sid, process_and_respond, speech_result, call_sid, turn)).start()
     
     # Immediate acknowledgment
     response = VoiceResponse()
@@ -116,24 +232,22 @@ def voice_continue():
     response = VoiceResponse()
     
     # Check if response is ready
+    record_event('voice_continue_poll', ready=call_sid in RESPONSE_CACHE)
     if call_sid in RESPONSE_CACHE:
-        s3_urls = RESPONSE_CACHE.pop(call_sid)
+        segments = RESPONSE_CACHE.pop(call_sid)
         
         # Add a short pause for better transition
         response.pause(length=0.5)
         
         # Play all audio files
-        for s3_url in s3_urls:
-            response.play(s3_url)
+        for segment in segments:
+            if "url" in segment:
+                response.play(segment["url"])
+            else:
+                response.say(segment["say"], voice='alice')
         
         # Add gather for continued conversation
-        gather = response.gather(
-            input='speech',
-            action='/twilio/voice/process',
-            method='POST',
-            speechTimeout='auto',
-            speechModel='phone_call'
-        )
+        gather = gather_speech(response)
         # Use OpenAI voice for the final prompt too
         final_prompt_url = "https://kooler-agent-tts.s3.amazonaws.com/final_prompt.mp3"
         gather.play(final_prompt_url) 
@@ -149,8 +263,8 @@ def sms_webhook():
     """Handle incoming SMS messages from Twilio"""
     incoming_msg = request.form.get('Body', '')
     
-    # Process the conversation with the AI assistant
-    ai_response = process_conversation(incoming_msg, mode='sms')
+    # Process the conversation with the AI assistant, keyed by the sender's number
+    ai_response = process_conversation(incoming_msg, mode='sms', session_id=request.form.get('From'))
     
     # Create TwiML response
     response = MessagingResponse()
@@ -169,6 +283,9 @@ def voice_memo_webhook():
         response.message("Sorry, I couldn't process your voice memo.")
         return Response(str(response), mimetype='text/xml')
     
+    # Transcription and the reply share one budget
+    deadline = Deadline(Config.SMS_TURN_BUDGET)
+    
     # Download the voice memo
     import requests
     audio_data = requests.get(media_url).content
@@ -179,19 +296,12 @@ def voice_memo_webhook():
     temp_file.write(audio_data)
     temp_file.close()
     
-    # Transcribe using OpenAI Whisper
+    # Transcribe using OpenAI Whisper, in parallel segments for long memos
     try:
-        with open(temp_filename, "rb") as audio_file:
-            transcript = openai.audio.transcriptions.create(
-                model="whisper-1", 
-                file=audio_file
-            )
-        
-        # Get the transcribed text
-        transcribed_text = transcript.text
+        transcribed_text = transcribe_audio_file(temp_filename, deadline=deadline)
         
         # Process with AI assistant
-        ai_response = process_conversation(transcribed_text, mode='sms')
+        ai_response = process_conversation(transcribed_text, mode='sms', session_id=request.form.get('From'), deadline=deadline)
         
         # Send response
         response = MessagingResponse()
@@ -2,7 +2,11 @@ import os
 import time
 import json
 import openai
+from datetime import datetime
 from app.config import Config
+from app.services.resilience_service import BREAKERS, CircuitOpenError, DeadlineExceeded, request_timeout
+from app.services.rate_limit_service import PRIORITY_BACKGROUND, openai_request
+from app.services.profiling_service import profile_span, record_event
 from app.utils import timer_decorator, logger
 
 # Initialize OpenAI client
@@ -11,6 +15,17 @@ openai.api_key = Config.OPENAI_API_KEY
 # Cache for assistant IDs
 ASSISTANT_CACHE = {}
 
+# Tools whose results are specific to the caller
+PERSONAL_TOOLS = {'schedule_appointment', 'check_appointment_status'}
+
+# Degraded local answers served when the assistant is unavailable or too slow
+FALLBACK_RESPONSES = {
+    'hours': "Kooler Garage Doors is open Monday through Friday from 8am to 6pm, and Saturday from 9am to 2pm.",
+    'warranty': "Kooler Garage Doors offers a 5-year warranty on all installations and a 1-year warranty on repairs.",
+    'appointment': "I'd be happy to help you schedule an appointment. Please provide your preferred date and time, and I'll check our availability.",
+    'default': "Thank you for contacting Kooler Garage Doors. How can I assist you with your garage door needs today?"
+}
+
 @timer_decorator
 def create_or_get_assistant(assistant_name="Kooler Agent"):
     """Create or retrieve an OpenAI Assistant"""
@@ -18,10 +33,15 @@ def create_or_get_assistant(assistant_name="Kooler Agent"):
     return "asst_ZvBCMQHlSt8xfPTjYbpet6se"
 
 @timer_decorator
-def create_thread():
+def create_thread(deadline=None, priority=PRIORITY_BACKGROUND):
     """Create a new conversation thread"""
     try:
-        thread = openai.beta.threads.create()
+        thread = openai_request(
+            'assistants',
+            openai.beta.threads.create,
+            priority=priority,
+            deadline=deadline
+        )
         return thread.id
     except Exception as e:
         logger.error(f"Error creating thread: {str(e)}")
@@ -29,40 +49,81 @@ def create_thread():
         return "thread_mock_for_testing"
 
 @timer_decorator
-def add_message_to_thread(thread_id, message, role="user"):
+def add_message_to_thread(thread_id, message, role="user", deadline=None, priority=PRIORITY_BACKGROUND):
     """Add a message to a thread"""
     try:
-        message = openai.beta.threads.messages.create(
+        message = openai_request(
+            'assistants',
+            openai.beta.threads.messages.create,
             thread_id=thread_id,
             role=role,
-            content=message
+            content=message,
+            priority=priority,
+            deadline=deadline
         )
         return message.id
     except Exception as e:
         logger.error(f"Error adding message to thread: {str(e)}")
         return "message_mock_for_testing"
 
+def cancel_run(thread_id, run_id, priority=PRIORITY_BACKGROUND):
+    """Best-effort cancellation of a run that is no longer wanted"""
+    try:
+        openai_request('assistants', openai.beta.threads.runs.cancel, thread_id=thread_id, run_id=run_id, priority=priority, timeout=2)
+    except Exception as e:
+        logger.error(f"Error cancelling run: {str(e)}")
+
 @timer_decorator
-def run_assistant(thread_id, assistant_id):
-    """Run the assistant on a thread and return the response"""
+def run_assistant(thread_id, assistant_id, deadline=None, priority=PRIORITY_BACKGROUND, turn_info=None, additional_messages=None):
+    """Run the assistant on a thread and return the response
+
+    turn_info, when given, collects the tools called and whether the
+    answer was degraded. additional_messages are added to the thread as
+    part of creating the run.
+    """
+    if turn_info is None:
+        turn_info = new_turn_info()
+    run = None
     try:
         # Create a run
-        run = openai.beta.threads.runs.create(
+        run = openai_request(
+            'assistants',
+            openai.beta.threads.runs.create,
             thread_id=thread_id,
-            assistant_id=assistant_id
+            assistant_id=assistant_id,
+            priority=priority,
+            deadline=deadline,
+            # A run is charged for the whole thread, not just the new message
+            estimated_tokens=Config.ASSISTANT_RUN_TOKEN_ESTIMATE,
+            **({'additional_messages': additional_messages} if additional_messages else {})
         )
         
         # Poll for completion
         while True:
-            run_status = openai.beta.threads.runs.retrieve(
+            if deadline is not None and deadline.expired():
+                # An overrun is the caller's budget, not an upstream fault; slow
+                # and failed requests already count against the breaker
+                cancel_run(thread_id, run.id, priority)
+                raise DeadlineExceeded("Assistant run exceeded the turn budget")
+            
+            run_status = openai_request(
+                'assistants',
+                openai.beta.threads.runs.retrieve,
                 thread_id=thread_id,
-                run_id=run.id
+                run_id=run.id,
+                priority=priority,
+                deadline=deadline
             )
+            record_event('run_status', status=run_status.status)
             
             if run_status.status == 'completed':
                 # Get messages
-                messages = openai.beta.threads.messages.list(
-                    thread_id=thread_id
+                messages = openai_request(
+                    'assistants',
+                    openai.beta.threads.messages.list,
+                    thread_id=thread_id,
+                    priority=priority,
+                    deadline=deadline
                 )
                 # Return the latest assistant message
                 for message in messages.data:
@@ -79,14 +140,8 @@ def run_assistant(thread_id, assistant_id):
                     function_args = json.loads(action.function.arguments)
                     
                     # Execute the appropriate function
-                    if function_name == 'schedule_appointment':
-                        result = handle_schedule_appointment(function_args)
-                    elif function_name == 'get_technical_info':
-                        result = handle_get_technical_info(function_args)
-                    elif function_name == 'check_appointment_status':
-                        result = handle_check_appointment_status(function_args)
-                    else:
-                        result = {"error": "Unknown function"}
+                    with profile_span(f"tool:{function_name}"):
+                        result = execute_tool_call(function_name, function_args, turn_info)
                     
                     tool_outputs.append({
                         "tool_call_id": action.id,
@@ -94,19 +149,33 @@ def run_assistant(thread_id, assistant_id):
                     })
                 
                 # Submit the outputs back to the assistant
-                openai.beta.threads.runs.submit_tool_outputs(
+                openai_request(
+                    'assistants',
+                    openai.beta.threads.runs.submit_tool_outputs,
                     thread_id=thread_id,
                     run_id=run.id,
-                    tool_outputs=tool_outputs
+                    tool_outputs=tool_outputs,
+                    priority=priority,
+                    deadline=deadline
                 )
             
             elif run_status.status in ['failed', 'cancelled', 'expired']:
+                turn_info["degraded"] = True
                 return f"Error: Run ended with status {run_status.status}"
             
-            time.sleep(1)  # Poll every second
+            # Poll every second, but never sleep past the budget
+            time.sleep(request_timeout(deadline, cap=1))
             
+    except (DeadlineExceeded, CircuitOpenError):
+        # Let the caller answer from the degraded path straight away
+        raise
     except Exception as e:
         logger.error(f"Error running assistant: {str(e)}")
+        if deadline is not None and deadline.expired():
+            if run is not None:
+                cancel_run(thread_id, run.id, priority)
+            raise DeadlineExceeded("Assistant run exceeded the turn budget")
+        turn_info["degraded"] = True
         # For testing without API key, return a mock response
         if Config.OPENAI_API_KEY == "your_openai_api_key":
             if "hours" in thread_id.lower():
@@ -117,40 +186,126 @@ def run_assistant(thread_id, assistant_id):
                 return "Thank you for contacting Kooler Garage Doors. How can I assist you with your garage door needs today?"
         return "I'm sorry, I encountered an error processing your request."
 
-@timer_decorator
-def process_with_assistant(message, thread_id=None):
-    """Process a message with the OpenAI Assistant"""
+def get_fallback_response(message):
+    """Degraded local answer used when the assistant is unavailable or too slow"""
+    if "hours" in message.lower():
+        return FALLBACK_RESPONSES['hours']
+    elif "warranty" in message.lower():
+        return FALLBACK_RESPONSES['warranty']
+    elif "appointment" in message.lower() or "schedule" in message.lower():
+        return FALLBACK_RESPONSES['appointment']
+    else:
+        return FALLBACK_RESPONSES['default']
+
+def new_turn_info(speculative_deadline=None):
+    """Per-turn record of the tools a backend called and whether it fell back
+
+    speculative_deadline is set for speculative runs, which are cancelled
+    rather than allowed to act on the caller's behalf.
+    """
+    return {"tools": [], "degraded": False, "speculative_deadline": speculative_deadline}
+
+def process_with_threads(message, thread_id=None, deadline=None, priority=PRIORITY_BACKGROUND, turn_info=None, carried=None):
+    """Answer a message by running the Assistant on an OpenAI thread
+    
+    carried messages (exchanges answered from the semantic cache) join the
+    thread ahead of the new message.
+    """
+    if turn_info is None:
+        turn_info = new_turn_info()
+    
     try:
-        # Create a thread if not provided
+        # Skip straight to the degraded answer while the Assistants API is tripped
+        if BREAKERS['assistants'].state() == "open":
+            raise CircuitOpenError("assistants circuit is open")
+        
+        # Create a thread if not provided, preferring one warmed on call arrival
         if not thread_id:
-            thread_id = create_thread()
+            # Import here to avoid circular imports
+            from app.services.caller_context_service import take_warm_thread
+            thread_id = take_warm_thread() or create_thread(deadline, priority)
         
-        # Add the message to the thread
-        add_message_to_thread(thread_id, message)
+        # Add the message to the thread, with any carried messages in the same request as the run
+        additional_messages = None
+        if carried:
+            additional_messages = list(carried) + [{"role": "user", "content": message}]
+        else:
+            if deadline is not None:
+                deadline.check("adding message")
+            add_message_to_thread(thread_id, message, deadline=deadline, priority=priority)
         
         # Get the assistant ID
         assistant_id = create_or_get_assistant()
         
         # Run the assistant
-        response = run_assistant(thread_id, assistant_id)
+        if deadline is not None:
+            deadline.check("running assistant")
+        response = run_assistant(thread_id, assistant_id, deadline, priority, turn_info, additional_messages)
         
         return response, thread_id
     except Exception as e:
         logger.error(f"Error processing with assistant: {str(e)}")
-        # For testing without API key, return a mock response
-        if "hours" in message.lower():
-            response = "Kooler Garage Doors is open Monday through Friday from 8am to 6pm, and Saturday from 9am to 2pm."
-        elif "warranty" in message.lower():
-            response = "Kooler Garage Doors offers a 5-year warranty on all installations and a 1-year warranty on repairs."
-        elif "appointment" in message.lower() or "schedule" in message.lower():
-            response = "I'd be happy to help you schedule an appointment. Please provide your preferred date and time, and I'll check our availability."
-        else:
-            response = "Thank you for contacting Kooler Garage Doors. How can I assist you with your garage door needs today?"
-        
-        return response, thread_id
+        turn_info["degraded"] = True
+        return get_fallback_response(message), thread_id
+
+@timer_decorator
+def process_with_assistant(message, thread_id=None, deadline=None, priority=PRIORITY_BACKGROUND, turn_index=0, carried=None):
+    """Process a message with the OpenAI Assistant
+    
+    Returns the response, the thread ID and the messages still to be
+    carried into the conversation: a cache hit never reaches the backend,
+    so its exchange is handed to the next turn instead.
+    """
+    # Import here to avoid circular imports
+    from app.services.semantic_cache_service import is_cacheable_question, lookup_answer, store_answer
+    from app.services.rate_limit_service import PRIORITY_SPECULATIVE
+    carried = list(carried or [])
+    
+    # Only opening questions are answered from the cache; later turns depend on context
+    cacheable = turn_index == 0 and is_cacheable_question(message)
+    embedding = None
+    if cacheable:
+        cached, embedding = lookup_answer(message, deadline, priority)
+        if cached is not None:
+            carried += [{"role": "user", "content": message}, {"role": "assistant", "content": cached["answer"]}]
+            return cached["answer"], thread_id, carried
+    
+    turn_info = new_turn_info(deadline if priority == PRIORITY_SPECULATIVE else None)
+    if Config.CONVERSATION_BACKEND == 'local':
+        from app.services.history_service import process_with_local_history
+        response, thread_id = process_with_local_history(message, thread_id, deadline, priority, turn_info, carried)
+    else:
+        response, thread_id = process_with_threads(message, thread_id, deadline, priority, turn_info, carried)
+    
+    # Answers built from a caller's own records are never shared, and
+    # speculative answers may be to a transcript the caller never finished
+    if (cacheable and priority != PRIORITY_SPECULATIVE and not turn_info["degraded"]
+            and not PERSONAL_TOOLS.intersection(turn_info["tools"])):
+        store_answer(message, response, embedding)
+    
+    return response, thread_id, []
 
 # Function handlers for the assistant functions
 
+def execute_tool_call(function_name, function_args, turn_info=None):
+    """Dispatch a function call from the assistant to its handler"""
+    if turn_info is not None:
+        # Caller-specific tools never run on a transcript that is still a guess
+        speculative_deadline = turn_info.get("speculative_deadline")
+        if speculative_deadline is not None and function_name in PERSONAL_TOOLS:
+            speculative_deadline.cancel()
+            raise DeadlineExceeded(f"Speculative run abandoned before {function_name}")
+        turn_info["tools"].append(function_name)
+    
+    if function_name == 'schedule_appointment':
+        return handle_schedule_appointment(function_args)
+    elif function_name == 'get_technical_info':
+        return handle_get_technical_info(function_args)
+    elif function_name == 'check_appointment_status':
+        return handle_check_appointment_status(function_args)
+    else:
+        return {"error": "Unknown function"}
+
 def handle_schedule_appointment(args):
     """Handle the schedule_appointment function"""
     try:
@@ -161,14 +316,26 @@ def handle_schedule_appointment(args):
         preferred_date = args.get('preferred_date', 'Unknown')
         preferred_time = args.get('preferred_time', 'Unknown')
         
+        # Use the customer record and open slots prefetched when the call arrived
+        # (import here to avoid circular imports)
+        from app.services.caller_context_service import get_caller_context
+        context = get_caller_context()
+        customer = (context or {}).get('customer') or {}
+        if customer_name == 'Unknown' and customer.get('name'):
+            customer_name = customer['name']
+        
         # Log the appointment request
         logger.info(f"Appointment request: {customer_name}, {service_type}, {preferred_date}, {preferred_time}")
         
-        return {
+        result = {
             "success": True,
             "appointment_id": "appt_" + str(int(time.time())),
             "message": f"Appointment scheduled for {customer_name} on {preferred_date} at {preferred_time} for {service_type} service."
         }
+        if context:
+            result["customer_id"] = customer.get('id')
+            result["available_slots"] = context['available_slots']
+        return result
     except Exception as e:
         logger.error(f"Error scheduling appointment: {str(e)}")
         return {
@@ -222,6 +389,30 @@ def handle_check_appointment_status(args):
         # Log the appointment status request
         logger.info(f"Appointment status request: {phone_number}, {appointment_id}")
         
+        # Answer from the appointments prefetched when the call arrived
+        # (import here to avoid circular imports)
+        from app.services.caller_context_service import get_caller_context
+        context = get_caller_context(phone_number=phone_number)
+        appointment = None
+        if context and context['appointments']:
+            appointments = context['appointments']
+            # An ID we didn't prefetch goes to the normal lookup rather than another appointment
+            if appointment_id:
+                appointment = next((a for a in appointments if a['id'] == appointment_id), None)
+            else:
+                appointment = appointments[0]
+        if appointment:
+            start = datetime.fromisoformat(appointment['start'])
+            end = datetime.fromisoformat(appointment['end'])
+            window = f"between {start.strftime('%I:%M %p').lstrip('0')} and {end.strftime('%I:%M %p').lstrip('0')}"
+            return {
+                "success": True,
+                "status": appointment['status'],
+                "technician": appointment['technician'],
+                "eta": f"{start.strftime('%Y-%m-%d')} {window}",
+                "message": f"Your appointment is {appointment['status']}. Our technician {appointment['technician']} will arrive on {start.strftime('%B')} {start.day} {window}."
+            }
+        
         return {
             "success": True,
             "status": "scheduled",
@@ -0,0 +1,119 @@
+import re
+import time
+import threading
+import concurrent.futures
+from datetime import datetime, timedelta
+from app.config import Config
+from app.services.conversation_service import SESSION_STORE
+from app.services.servicetitan_service import find_customer_by_phone, get_customer_jobs, get_customer_appointments, get_available_slots
+from app.utils import timer_decorator, logger, get_call_sid, run_with_call_sid
+
+# Latest CallSid for each caller's phone number
+PHONE_INDEX = {}
+PREFETCH_LOCK = threading.Lock()
+
+PREFETCH_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+def normalize_phone(phone_number):
+    """Compare phone numbers on their last ten digits"""
+    digits = re.sub(r"\D", "", phone_number or "")
+    return digits[-10:] or None
+
+def _prune_stale(now):
+    """Forget prefetched context for calls that ended long ago; call with the lock held"""
+    for call_sid, session in list(SESSION_STORE.items()):
+        context = session.get('caller_context')
+        if context is not None and now - context['started_at'] > Config.PREFETCH_TTL_SECONDS:
+            SESSION_STORE.pop(call_sid, None)
+            if PHONE_INDEX.get(normalize_phone(context['phone_number'])) == call_sid:
+                PHONE_INDEX.pop(normalize_phone(context['phone_number']), None)
+
+@timer_decorator
+def prefetch_caller_context(call_sid, context):
+    """Load the caller's ServiceTitan records and warm an Assistant thread"""
+    try:
+        customer = find_customer_by_phone(context['phone_number'])
+        context['customer'] = customer
+        if customer:
+            context['jobs'] = get_customer_jobs(customer['id'])
+            context['appointments'] = get_customer_appointments(customer['id'])
+
+        today = datetime.now()
+        context['available_slots'] = get_available_slots(
+            None,
+            today.strftime('%Y-%m-%d'),
+            (today + timedelta(days=Config.PREFETCH_SLOT_DAYS)).strftime('%Y-%m-%d')
+        )
+
+        if Config.CONVERSATION_BACKEND != 'local':
+            # Import here to avoid circular imports
+            from app.services.assistant_service import create_thread
+            thread_id = create_thread()
+            if not thread_id.startswith("thread_mock"):
+                SESSION_STORE[call_sid]['warm_thread_id'] = thread_id
+    except Exception as e:
+        logger.error(f"Error prefetching caller context: {str(e)}")
+    finally:
+        context['loaded_at'] = time.time()
+        context['ready'].set()
+
+def start_caller_prefetch(call_sid, phone_number):
+    """Start loading caller context in the background as soon as a call arrives"""
+    if not call_sid:
+        return
+
+    now = time.time()
+    with PREFETCH_LOCK:
+        _prune_stale(now)
+        session = SESSION_STORE.setdefault(call_sid, {})
+        if 'caller_context' in session:
+            return
+
+        context = {
+            "call_sid": call_sid,
+            "phone_number": phone_number,
+            "customer": None,
+            "jobs": [],
+            "appointments": [],
+            "available_slots": [],
+            "started_at": now,
+            "loaded_at": None,
+            "ready": threading.Event()
+        }
+        session['caller_context'] = context
+        phone = normalize_phone(phone_number)
+        if phone:
+            PHONE_INDEX[phone] = call_sid
+
+    PREFETCH_EXECUTOR.submit(run_with_call_sid, call_sid, prefetch_caller_context, call_sid, context)
+
+def get_caller_context(phone_number=None, call_sid=None, wait=None):
+    """Prefetched context for the current call or a phone number, or None
+
+    When phone_number is given only context for that number is returned,
+    even on a call from another number. Waits up to PREFETCH_WAIT_SECONDS
+    for a prefetch still in flight, which is cheaper than starting the
+    same lookups again.
+    """
+    phone = normalize_phone(phone_number)
+    call_sid = call_sid or get_call_sid()
+    context = SESSION_STORE.get(call_sid, {}).get('caller_context') if call_sid else None
+    if context is not None and phone and normalize_phone(context['phone_number']) != phone:
+        context = None
+    if context is None and phone:
+        phone_call_sid = PHONE_INDEX.get(phone)
+        context = SESSION_STORE.get(phone_call_sid, {}).get('caller_context') if phone_call_sid else None
+    if context is None:
+        return None
+
+    if not context['ready'].wait(Config.PREFETCH_WAIT_SECONDS if wait is None else wait):
+        return None
+    return context
+
+def take_warm_thread(call_sid=None):
+    """Hand the pre-created Assistant thread to the first turn of the call that needs one"""
+    call_sid = call_sid or get_call_sid()
+    if not call_sid:
+        return None
+    with PREFETCH_LOCK:
+        return SESSION_STORE.get(call_sid, {}).pop('warm_thread_id', None)
@@ -1,27 +1,64 @@
 from app.utils import timer_decorator, logger
-from app.services.assistant_service import process_with_assistant
+from app.config import Config
+from app.services.assistant_service import process_with_assistant, get_fallback_response
+from app.services.resilience_service import Deadline
+from app.services.rate_limit_service import PRIORITY_VOICE, PRIORITY_SMS, PRIORITY_BACKGROUND
 import json
 
 # Simple in-memory session store (replace with Redis in production)
 SESSION_STORE = {}
 
+# Latency budget for a single turn in each mode
+TURN_BUDGETS = {
+    'voice': Config.VOICE_TURN_BUDGET,
+    'sms': Config.SMS_TURN_BUDGET,
+    'api': Config.API_TURN_BUDGET
+}
+
+# Live callers are served ahead of texts, texts ahead of everything else
+MODE_PRIORITIES = {
+    'voice': PRIORITY_VOICE,
+    'sms': PRIORITY_SMS
+}
+
+def adopt_session(session_id, scratch):
+    """Continue a session from the conversation a speculative run started in a scratch session"""
+    session = SESSION_STORE.setdefault(session_id, {})
+    if scratch.get('turns') and not session.get('turns'):
+        session['thread_id'] = scratch.get('thread_id')
+        session['turns'] = scratch['turns']
+        session['carried'] = scratch.get('carried', [])
+
 @timer_decorator
-def process_conversation(message, mode='api', session_id=None):
+def process_conversation(message, mode='api', session_id=None, deadline=None, priority=None):
     """Process a conversation message and return a response"""
     try:
-        # Get existing thread ID from session if available
+        # Every turn runs against a latency budget
+        if deadline is None:
+            deadline = Deadline(TURN_BUDGETS.get(mode, Config.API_TURN_BUDGET))
+        
+        if priority is None:
+            priority = MODE_PRIORITIES.get(mode, PRIORITY_BACKGROUND)
+        
+        # Get existing thread ID, turn count and carried messages from session if available
         thread_id = None
+        turn_index = 0
+        carried = []
         if session_id and session_id in SESSION_STORE:
             thread_id = SESSION_STORE.get(session_id, {}).get('thread_id')
+            turn_index = SESSION_STORE.get(session_id, {}).get('turns', 0)
+            carried = SESSION_STORE.get(session_id, {}).get('carried', [])
         
         # Process the message with the OpenAI Assistant
-        response, new_thread_id = process_with_assistant(message, thread_id)
+        response, new_thread_id, carried = process_with_assistant(message, thread_id, deadline, priority, turn_index, carried)
         
         # Store the thread ID in the session
         if session_id:
             if session_id not in SESSION_STORE:
                 SESSION_STORE[session_id] = {}
             SESSION_STORE[session_id]['thread_id'] = new_thread_id
+            SESSION_STORE[session_id]['turns'] = turn_index + 1
+            SESSION_STORE[session_id]['carried'] = carried
         
         # Log the conversation
         logger.info(f"Mode: {mode}, Message: {message}, Response: {response}")
@@ -30,11 +67,4 @@ def process_conversation(message, mode='api', session_id=None):
     except Exception as e:
         logger.error(f"Error processing conversation: {str(e)}")
         # Fallback responses if there's an error
-        if "hours" in message.lower():
-            return "Kooler Garage Doors is open Monday through Friday from 8am to 6pm, and Saturday from 9am to 2pm."
-        elif "warranty" in message.lower():
-            return "Kooler Garage Doors offers a 5-year warranty on all installations and a 1-year warranty on repairs."
-        elif "appointment" in message.lower() or "schedule" in message.lower():
-            return "I'd be happy to help you schedule an appointment. Please provide your preferred date and time, and I'll check our availability."
-        else:
-            return "Thank you for contacting Kooler Garage Doors. How can I assist you with your garage door needs today?"
+        return get_fallback_response(message)
@@ -0,0 +1,268 @@
+import json
+import uuid
+import threading
+import concurrent.futures
+from collections import OrderedDict
+import openai
+from app.config import Config
+from app.services.assistant_service import execute_tool_call, get_fallback_response, new_turn_info
+from app.services.resilience_service import BREAKERS, CircuitOpenError, DeadlineExceeded
+from app.services.rate_limit_service import PRIORITY_BACKGROUND, openai_request
+from app.services.profiling_service import profile_span
+from app.utils import timer_decorator, logger
+
+# Per-session compact history, least recently used sessions evicted first
+HISTORY_STORE = OrderedDict()
+HISTORY_LOCK = threading.Lock()
+
+# Rolling summaries are folded in off the request path
+SUMMARY_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+# Tool rounds allowed per turn before giving up on a final answer
+MAX_TOOL_ROUNDS = 3
+
+SYSTEM_PROMPT = (
+    "You are the phone and text assistant for Kooler Garage Doors. "
+    "Answer briefly and conversationally, in one to three sentences suitable for being read aloud. "
+    "Use the available functions to schedule appointments, look up technical information "
+    "and check appointment status. Never invent appointment details."
+)
+
+LOCAL_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "schedule_appointment",
+            "description": "Schedule a service appointment for a customer",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "customer_name": {"type": "string"},
+                    "service_type": {"type": "string"},
+                    "preferred_date": {"type": "string"},
+                    "preferred_time": {"type": "string"}
+                },
+                "required": ["customer_name", "service_type"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_technical_info",
+            "description": "Look up technical information about garage doors, springs and openers",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "search_query": {"type": "string"},
+                    "model_number": {"type": "string"},
+                    "part_name": {"type": "string"}
+                },
+                "required": ["search_query"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "check_appointment_status",
+            "description": "Check the status of an existing appointment",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "phone_number": {"type": "string"},
+                    "appointment_id": {"type": "string"}
+                }
+            }
+        }
+    }
+]
+
+def estimate_tokens(text):
+    """Cheap token estimate (about four characters per token plus message overhead)"""
+    return len(text or "") // 4 + 4
+
+def get_history(session_id):
+    """Return the history for a session, creating it if needed"""
+    with HISTORY_LOCK:
+        history = HISTORY_STORE.get(session_id)
+        if history is None:
+            history = {
+                "turns": [],
+                "summary": "",
+                "summarizing": False,
+                "lock": threading.Lock()
+            }
+            HISTORY_STORE[session_id] = history
+            while len(HISTORY_STORE) > Config.HISTORY_MAX_SESSIONS:
+                HISTORY_STORE.popitem(last=False)
+        else:
+            HISTORY_STORE.move_to_end(session_id)
+        return history
+
+def build_window(history, budget):
+    """Pick the most recent turns that fit the token budget
+
+    Returns the window and the number of older turns left outside it.
+    """
+    with history["lock"]:
+        turns = list(history["turns"])
+        budget -= estimate_tokens(history["summary"])
+
+    window = []
+    for turn in reversed(turns):
+        if budget - turn["tokens"] < 0:
+            break
+        budget -= turn["tokens"]
+        window.append(turn)
+    window.reverse()
+    return window, len(turns) - len(window)
+
+def summarize_turns(summary, turns):
+    """Fold older turns into the rolling summary"""
+    transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    prompt = f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"
+    completion = openai_request(
+        'chat',
+        openai.chat.completions.create,
+        model=Config.LOCAL_CHAT_MODEL,
+        messages=[
+            {"role": "system", "content": "Maintain a short running summary of a customer service call. Keep names, phone numbers, dates, appointment details and open questions. Reply with the updated summary only."},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=200,
+        timeout=30,
+        priority=PRIORITY_BACKGROUND,
+        estimated_tokens=estimate_tokens(prompt) + 200
+    )
+    return completion.choices[0].message.content.strip()
+
+def update_summary(session_id, count):
+    """Background job folding the oldest turns into the session summary"""
+    history = get_history(session_id)
+    try:
+        with history["lock"]:
+            turns = history["turns"][:count]
+            summary = history["summary"]
+
+        new_summary = summarize_turns(summary, turns)
+
+        with history["lock"]:
+            history["summary"] = new_summary
+            # Turns only leave local history once they are in the summary
+            del history["turns"][:count]
+        logger.info(f"Folded {count} turns into summary for {session_id}")
+    except Exception as e:
+        logger.error(f"Error updating conversation summary: {str(e)}")
+    finally:
+        with history["lock"]:
+            history["summarizing"] = False
+
+def schedule_summary(session_id, history, count):
+    """Start a background summary update unless one is already running"""
+    with history["lock"]:
+        if history["summarizing"] or count <= 0:
+            return
+        history["summarizing"] = True
+    SUMMARY_EXECUTOR.submit(update_summary, session_id, count)
+
+def append_turn(history, role, content):
+    with history["lock"]:
+        history["turns"].append({"role": role, "content": content, "tokens": estimate_tokens(content)})
+
+def stream_completion(messages, deadline=None, priority=PRIORITY_BACKGROUND):
+    """Stream a chat completion, returning the text and any requested tool calls"""
+    stream = openai_request(
+        'chat',
+        openai.chat.completions.create,
+        model=Config.LOCAL_CHAT_MODEL,
+        messages=messages,
+        tools=LOCAL_TOOLS,
+        stream=True,
+        priority=priority,
+        deadline=deadline,
+        estimated_tokens=sum(estimate_tokens(m.get("content")) for m in messages) + Config.LOCAL_COMPLETION_TOKEN_ESTIMATE
+    )
+
+    content = []
+    tool_calls = {}
+    for chunk in stream:
+        if deadline is not None and deadline.expired():
+            stream.close()
+            raise DeadlineExceeded("Completion exceeded the turn budget")
+        if not chunk.choices:
+            continue
+
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content.append(delta.content)
+        for tool_call in delta.tool_calls or []:
+            call = tool_calls.setdefault(tool_call.index, {"id": None, "name": "", "arguments": ""})
+            if tool_call.id:
+                call["id"] = tool_call.id
+            if tool_call.function and tool_call.function.name:
+                call["name"] += tool_call.function.name
+            if tool_call.function and tool_call.function.arguments:
+                call["arguments"] += tool_call.function.arguments
+
+    return "".join(content), [tool_calls[i] for i in sorted(tool_calls)]
+
+@timer_decorator
+def process_with_local_history(message, session_id=None, deadline=None, priority=PRIORITY_BACKGROUND, turn_info=None, carried=None):
+    """Answer a message from locally kept history instead of an OpenAI thread
+
+    carried messages (exchanges answered from the semantic cache) are
+    added to the history first.
+    """
+    if turn_info is None:
+        turn_info = new_turn_info()
+    if not session_id:
+        session_id = f"local_{uuid.uuid4().hex}"
+
+    history = get_history(session_id)
+    for carried_message in carried or []:
+        append_turn(history, carried_message["role"], carried_message["content"])
+
+    try:
+        if BREAKERS['chat'].state() == "open":
+            raise CircuitOpenError("chat circuit is open")
+
+        window, evicted = build_window(history, Config.HISTORY_TOKEN_BUDGET - estimate_tokens(message))
+        schedule_summary(session_id, history, evicted)
+
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        if history["summary"]:
+            messages.append({"role": "system", "content": f"Summary of the conversation so far: {history['summary']}"})
+        messages.extend({"role": turn["role"], "content": turn["content"]} for turn in window)
+        messages.append({"role": "user", "content": message})
+
+        response = ""
+        for _ in range(MAX_TOOL_ROUNDS + 1):
+            response, tool_calls = stream_completion(messages, deadline, priority)
+            if not tool_calls:
+                break
+
+            # Tool exchanges stay in this request only; history keeps the final answer
+            messages.append({
+                "role": "assistant",
+                "content": response or None,
+                "tool_calls": [
+                    {"id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": call["arguments"]}}
+                    for call in tool_calls
+                ]
+            })
+            for call in tool_calls:
+                with profile_span(f"tool:{call['name']}"):
+                    result = execute_tool_call(call["name"], json.loads(call["arguments"] or "{}"), turn_info)
+                messages.append({"role": "tool", "tool_call_id": call["id"], "content": json.dumps(result)})
+
+        if not response:
+            raise ValueError("Completion returned no text")
+
+        append_turn(history, "user", message)
+        append_turn(history, "assistant", response)
+        return response, session_id
+    except Exception as e:
+        logger.error(f"Error processing with local history: {str(e)}")
+        turn_info["degraded"] = True
+        return get_fallback_response(message), session_id
@@ -0,0 +1,199 @@
+import sys
+import time
+import random
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from app.config import Config
+from app.utils import THREAD_CALLS, get_call_sid, logger
+
+# Ring buffer of call timelines, oldest evicted first
+PROFILES = OrderedDict()
+PROFILES_LOCK = threading.Lock()
+
+# Stack sampler shared by every profile that asked for one
+SAMPLER = {"thread": None}
+
+def should_profile(headers, args):
+    """Decide from the request whether to profile this call
+
+    Returns (enabled, sample_stacks). An X-Kooler-Profile header or a
+    profile query parameter of "1" turns profiling on and "cpu" also
+    samples stacks; otherwise a PROFILE_SAMPLE_RATE fraction of calls is
+    profiled without stack sampling.
+    """
+    flag = headers.get('X-Kooler-Profile') or args.get('profile')
+    if flag in ('1', 'cpu'):
+        return True, flag == 'cpu'
+    return random.random() < Config.PROFILE_SAMPLE_RATE, False
+
+def start_profile(call_sid, sample_stacks=False):
+    """Start recording a timeline for a call"""
+    if not call_sid:
+        return
+
+    with PROFILES_LOCK:
+        if call_sid in PROFILES:
+            return
+        PROFILES[call_sid] = {
+            "call_sid": call_sid,
+            "started_at": time.time(),
+            "events": [],
+            "dropped_events": 0,
+            "samples": Counter(),
+            "sample_until": time.time() + Config.PROFILE_MAX_SECONDS if sample_stacks else 0
+        }
+        while len(PROFILES) > Config.PROFILE_BUFFER_SIZE:
+            PROFILES.popitem(last=False)
+
+    logger.info(f"Profiling call {call_sid}")
+    if sample_stacks:
+        start_sampler()
+
+def record_span(name, start_time, end_time, **attrs):
+    """Add a timed stage to the timeline of the call bound to this context"""
+    profile = PROFILES.get(get_call_sid())
+    if profile is None:
+        return
+
+    with PROFILES_LOCK:
+        if len(profile["events"]) >= Config.PROFILE_MAX_EVENTS:
+            profile["dropped_events"] += 1
+            return
+        profile["events"].append({
+            "name": name,
+            "start_ms": round((start_time - profile["started_at"]) * 1000, 2),
+            "duration_ms": round((end_time - start_time) * 1000, 2),
+            "thread": threading.current_thread().name,
+            "attrs": attrs
+        })
+
+def record_event(name, **attrs):
+    """Add an instant (such as a webhook arrival) to the call's timeline"""
+    now = time.time()
+    record_span(name, now, now, **attrs)
+
+@contextmanager
+def profile_span(name, **attrs):
+    """Time a block of code as a stage in the call's timeline"""
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        record_span(name, start_time, time.time(), **attrs)
+
+def fold_stack(frame):
+    """Render a frame's stack root first, in collapsed-stack format"""
+    names = []
+    while frame is not None:
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+def sample_stacks():
+    """Sampler loop: attribute every bound thread's current stack to its call"""
+    interval = Config.PROFILE_SAMPLE_INTERVAL_MS / 1000.0
+    while True:
+        now = time.time()
+        with PROFILES_LOCK:
+            active = {call_sid for call_sid, profile in PROFILES.items() if profile["sample_until"] > now}
+            if not active:
+                SAMPLER["thread"] = None
+                return
+
+        frames = sys._current_frames()
+        stacks = [
+            (call_sid, fold_stack(frames[ident]))
+            for ident, call_sid in list(THREAD_CALLS.items())
+            if call_sid in active and ident in frames
+        ]
+        del frames
+
+        # Readers iterate the counters under the same lock
+        with PROFILES_LOCK:
+            for call_sid, stack in stacks:
+                profile = PROFILES.get(call_sid)
+                if profile is not None:
+                    profile["samples"][stack] += 1
+
+        time.sleep(interval)
+
+def start_sampler():
+    with PROFILES_LOCK:
+        if SAMPLER["thread"] is not None:
+            return
+        SAMPLER["thread"] = threading.Thread(target=sample_stacks, name="profile-sampler", daemon=True)
+    SAMPLER["thread"].start()
+
+def list_profiles():
+    """Summaries of the buffered call profiles, newest first"""
+    with PROFILES_LOCK:
+        return [
+            {
+                "call_sid": profile["call_sid"],
+                "started_at": profile["started_at"],
+                "events": len(profile["events"]),
+                "samples": sum(profile["samples"].values())
+            }
+            for profile in reversed(list(PROFILES.values()))
+        ]
+
+def get_profile(call_sid):
+    """Full timeline for a call as JSON-serializable data"""
+    profile = PROFILES.get(call_sid)
+    if profile is None:
+        return None
+
+    with PROFILES_LOCK:
+        return {
+            "call_sid": profile["call_sid"],
+            "started_at": profile["started_at"],
+            "events": list(profile["events"]),
+            "dropped_events": profile["dropped_events"],
+            "samples": sum(profile["samples"].values())
+        }
+
+def get_folded_stacks(call_sid):
+    """Stack samples in collapsed-stack format for flamegraph.pl or speedscope
+
+    Calls profiled without stack sampling fall back to their timeline
+    spans, weighted by milliseconds.
+    """
+    profile = PROFILES.get(call_sid)
+    if profile is None:
+        return None
+
+    with PROFILES_LOCK:
+        if profile["samples"]:
+            lines = [f"{stack} {count}" for stack, count in profile["samples"].most_common()]
+        else:
+            lines = [
+                f"{event['thread']};{event['name']} {max(1, int(event['duration_ms']))}"
+                for event in profile["events"]
+            ]
+    return "\n".join(lines) + "\n"
+
+def get_trace_events(call_sid):
+    """Timeline in Chrome trace event format for chrome://tracing or Perfetto"""
+    profile = PROFILES.get(call_sid)
+    if profile is None:
+        return None
+
+    with PROFILES_LOCK:
+        events = list(profile["events"])
+
+    return {
+        "traceEvents": [
+            {
+                "name": event["name"],
+                "ph": "X",
+                "ts": event["start_ms"] * 1000,
+                "dur": event["duration_ms"] * 1000,
+                "pid": call_sid,
+                "tid": event["thread"],
+                "args": event["attrs"]
+            }
+            for event in events
+        ],
+        "displayTimeUnit": "ms"
+    }
@@ -0,0 +1,271 @@
+import time
+import heapq
+import itertools
+import threading
+from email.utils import parsedate_to_datetime
+import openai
+from app.config import Config
+from app.services.resilience_service import BREAKERS, CircuitOpenError, DeadlineExceeded, timeout_kwargs
+from app.services.profiling_service import record_event
+from app.utils import logger
+
+# Priority classes, lower runs first
+PRIORITY_VOICE = 0
+PRIORITY_SPECULATIVE = 1
+PRIORITY_SMS = 2
+PRIORITY_BACKGROUND = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_VOICE: "voice",
+    PRIORITY_SPECULATIVE: "speculative",
+    PRIORITY_SMS: "sms",
+    PRIORITY_BACKGROUND: "background"
+}
+
+# Retries are handled here so 429s respect priority and retry-after
+openai.max_retries = 0
+
+# Errors the OpenAI client would have retried itself, with its backoff
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.InternalServerError)
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 8.0
+
+class TokenBucket:
+    """Bucket refilled continuously up to a per-minute limit"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated_at = time.time()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount, reserve=0.0):
+        """Seconds until amount can be taken while leaving reserve of the capacity untouched"""
+        needed = min(amount, self.capacity) + self.capacity * reserve - self.tokens
+        return max(0.0, needed / self.rate)
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+class ModelScheduler:
+    """Admits requests for one model in priority order within its RPM/TPM limits"""
+
+    def __init__(self, name, rpm, tpm=None):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.paused_until = 0.0
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+    def _wait_time(self, priority, estimated_tokens, now):
+        # Lower priorities leave headroom so live calls are not starved by a backlog
+        reserve = 0.0 if priority == PRIORITY_VOICE else Config.RATE_LIMIT_RESERVE
+        wait = max(self.paused_until - now, self.requests.wait_time(1, reserve))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(estimated_tokens, reserve))
+        return wait
+
+    def acquire(self, priority, estimated_tokens=0, deadline=None):
+        """Block until this request may be sent and return how long it waited"""
+        start_time = time.time()
+        waiter = (priority, next(self.sequence))
+        with self.condition:
+            heapq.heappush(self.waiters, waiter)
+            try:
+                while True:
+                    now = time.time()
+                    self.requests.refill(now)
+                    if self.tokens is not None:
+                        self.tokens.refill(now)
+
+                    # A spent budget is never admitted, so it can't be sent with no timeout left
+                    if deadline is not None and deadline.expired():
+                        raise DeadlineExceeded(f"Turn budget exhausted waiting for {self.name} rate limit")
+
+                    wait = self._wait_time(priority, estimated_tokens, now) if self.waiters[0] == waiter else None
+                    if wait == 0:
+                        self.requests.take(1)
+                        if self.tokens is not None:
+                            self.tokens.take(estimated_tokens)
+                        return now - start_time
+
+                    # Waiters behind the head are woken when the head is admitted
+                    timeout = wait if wait is not None else 1.0
+                    if deadline is not None:
+                        timeout = min(timeout, deadline.remaining())
+                    self.condition.wait(max(timeout, 0.01))
+            finally:
+                self.waiters.remove(waiter)
+                heapq.heapify(self.waiters)
+                self.condition.notify_all()
+
+    def pause(self, seconds):
+        """Hold all requests for this model after a 429"""
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+            self.condition.notify_all()
+
+# One scheduler per rate-limited model
+SCHEDULERS = {
+    model: ModelScheduler(model, limits['rpm'], limits.get('tpm'))
+    for model, limits in Config.OPENAI_RATE_LIMITS.items()
+}
+
+# Queue wait per priority class
+SCHEDULER_STATS = {
+    name: {"requests": 0, "rate_limited": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+    for name in PRIORITY_NAMES.values()
+}
+SCHEDULER_STATS_LOCK = threading.Lock()
+
+def parse_retry_after(headers):
+    """Seconds to back off, from retry-after-ms, retry-after or the rate limit reset headers"""
+    if headers is None:
+        return None
+
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000.0
+    except ValueError:
+        pass
+
+    retry_after = headers.get('retry-after')
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    # Reset headers look like "1s", "250ms" or "6m0s"
+    resets = [parse_duration(headers.get(name)) for name in ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens')]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+def parse_duration(value):
+    if not value:
+        return None
+
+    seconds = 0.0
+    number = ""
+    i = 0
+    while i < len(value):
+        char = value[i]
+        if char.isdigit() or char == '.':
+            number += char
+        elif value.startswith('ms', i):
+            seconds += float(number or 0) / 1000.0
+            number = ""
+            i += 1
+        elif char in 'hms':
+            seconds += float(number or 0) * {'h': 3600, 'm': 60, 's': 1}[char]
+            number = ""
+        else:
+            return None
+        i += 1
+    return seconds
+
+def record_wait(priority, wait_seconds, rate_limited=False):
+    with SCHEDULER_STATS_LOCK:
+        stats = SCHEDULER_STATS[PRIORITY_NAMES[priority]]
+        if rate_limited:
+            stats["rate_limited"] += 1
+            return
+        wait_ms = wait_seconds * 1000
+        stats["requests"] += 1
+        stats["total_wait_ms"] += wait_ms
+        stats["max_wait_ms"] = max(stats["max_wait_ms"], wait_ms)
+
+def openai_request(upstream, func, *args, model=None, priority=PRIORITY_BACKGROUND, deadline=None, estimated_tokens=0, **kwargs):
+    """Send an OpenAI request through the rate limit scheduler and the upstream's circuit breaker
+
+    model picks the rate limit buckets and is passed on to the request;
+    requests without a model argument (threads, runs) use the upstream's buckets.
+    """
+    scheduler = SCHEDULERS.get(model or upstream)
+    if model is not None:
+        kwargs['model'] = model
+
+    # One breaker result per request: attempts that will be retried don't count
+    breaker = BREAKERS[upstream]
+    for attempt in range(Config.RATE_LIMIT_MAX_RETRIES + 1):
+        last_attempt = attempt == Config.RATE_LIMIT_MAX_RETRIES
+        if scheduler is not None:
+            wait = scheduler.acquire(priority, estimated_tokens, deadline)
+            record_wait(priority, wait)
+            record_event('queue_wait', model=scheduler.name, priority=PRIORITY_NAMES[priority], wait_ms=round(wait * 1000, 2))
+            if wait > 0.1:
+                logger.info(f"Waited {wait * 1000:.2f} ms for {scheduler.name} ({PRIORITY_NAMES[priority]})")
+
+        if deadline is not None:
+            deadline.check(f"{model or upstream} request")
+        if not breaker.allow():
+            raise CircuitOpenError(f"{breaker.name} circuit is open")
+
+        # A timeout shorter than the breaker's slow-call threshold is the caller's budget, not the upstream
+        timeout = timeout_kwargs(deadline)
+        budget_limited = 'timeout' in timeout and timeout['timeout'] < breaker.slow_call_seconds
+
+        start_time = time.time()
+        try:
+            result = func(*args, **kwargs, **timeout)
+        except openai.RateLimitError as e:
+            # 429s say nothing about the upstream's health
+            breaker.release()
+            record_wait(priority, 0, rate_limited=True)
+            retry_after = parse_retry_after(getattr(e.response, 'headers', None)) or 2 ** attempt
+            if scheduler is not None:
+                scheduler.pause(retry_after)
+            if last_attempt or (deadline is not None and deadline.remaining() < retry_after):
+                logger.warning(f"Rate limited on {model or upstream}, giving up")
+                raise
+            logger.warning(f"Rate limited on {model or upstream}, backing off {retry_after:.2f}s")
+            if scheduler is None:
+                time.sleep(retry_after)
+            continue
+        except TRANSIENT_ERRORS as e:
+            if budget_limited and isinstance(e, openai.APITimeoutError):
+                breaker.release()
+                raise DeadlineExceeded(f"Turn budget exhausted during {model or upstream} request") from e
+            retry_after = min(RETRY_BASE_SECONDS * 2 ** attempt, RETRY_MAX_SECONDS)
+            if last_attempt or (deadline is not None and deadline.remaining() < retry_after):
+                breaker.record_failure("error")
+                raise
+            breaker.release()
+            logger.warning(f"{type(e).__name__} from {model or upstream}, retrying in {retry_after:.2f}s")
+            time.sleep(retry_after)
+            continue
+        except Exception:
+            breaker.record_failure("error")
+            raise
+
+        breaker.record_call(time.time() - start_time)
+        return result
+
+def get_scheduler_stats():
+    """Queue wait per priority class plus current bucket levels per model"""
+    with SCHEDULER_STATS_LOCK:
+        classes = {name: dict(stats) for name, stats in SCHEDULER_STATS.items()}
+
+    for stats in classes.values():
+        stats["avg_wait_ms"] = stats["total_wait_ms"] / stats["requests"] if stats["requests"] else 0.0
+
+    models = {}
+    for model, scheduler in SCHEDULERS.items():
+        with scheduler.condition:
+            models[model] = {
+                "queued": len(scheduler.waiters),
+                "requests_available": round(scheduler.requests.tokens, 2),
+                "tokens_available": round(scheduler.tokens.tokens, 2) if scheduler.tokens is not None else None,
+                "paused_for": max(0.0, scheduler.paused_until - time.time())
+            }
+
+    return {"classes": classes, "models": models}
@@ -0,0 +1,137 @@
+import time
+import threading
+from app.config import Config
+from app.utils import logger
+
+class DeadlineExceeded(Exception):
+    """Raised when a turn has used up its latency budget"""
+
+class CircuitOpenError(Exception):
+    """Raised when an upstream's circuit breaker is rejecting calls"""
+
+class Deadline:
+    """Latency budget for a single conversation turn"""
+
+    def __init__(self, seconds):
+        self.expires_at = time.time() + seconds
+        self.cancelled = False
+
+    def cancel(self):
+        """Spend the rest of the budget now so work checking it stops early"""
+        self.cancelled = True
+
+    def remaining(self):
+        """Seconds left in the budget, never negative"""
+        if self.cancelled:
+            return 0.0
+        return max(0.0, self.expires_at - time.time())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, stage):
+        """Raise DeadlineExceeded if the budget is spent before a stage starts"""
+        if self.expired():
+            raise DeadlineExceeded(f"Turn budget exhausted before {stage}")
+
+    def timeout(self, cap=None):
+        """Remaining budget as a request timeout, optionally capped"""
+        remaining = self.remaining()
+        return min(remaining, cap) if cap is not None else remaining
+
+def request_timeout(deadline, cap=None):
+    """Timeout for an upstream request, or cap when the caller has no budget"""
+    return deadline.timeout(cap) if deadline is not None else cap
+
+def timeout_kwargs(deadline):
+    """Request options that bound an OpenAI call by the remaining budget"""
+    return {'timeout': deadline.remaining()} if deadline is not None else {}
+
+class CircuitBreaker:
+    """Trips after repeated errors or slow calls and rejects calls until it cools down"""
+
+    def __init__(self, name, failure_threshold, slow_call_seconds, reset_seconds):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.time() - self.opened_at < self.reset_seconds:
+                return "open"
+            return "half_open"
+
+    def allow(self):
+        """Return True if a call may go through; half-open lets a single trial call in"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at < self.reset_seconds or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit breaker {self.name} closed")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def release(self):
+        """End a call without a verdict, letting the next half-open trial through"""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self, reason="error"):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+                logger.warning(f"Circuit breaker {self.name} open after {reason}")
+
+    def call(self, func, *args, **kwargs):
+        """Call func through the breaker, counting errors and slow responses as failures"""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+        start_time = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure("error")
+            raise
+
+        self.record_call(time.time() - start_time)
+        return result
+
+    def record_call(self, elapsed):
+        """Record a completed call, counting it as a failure if it was slow"""
+        if elapsed > self.slow_call_seconds:
+            self.record_failure("slow call")
+        else:
+            self.record_success()
+
+# One breaker per upstream dependency
+BREAKERS = {
+    name: CircuitBreaker(
+        name,
+        failure_threshold=Config.BREAKER_FAILURE_THRESHOLD,
+        slow_call_seconds=slow_call_seconds,
+        reset_seconds=Config.BREAKER_RESET_SECONDS
+    )
+    for name, slow_call_seconds in Config.BREAKER_SLOW_CALL_SECONDS.items()
+}
+
+def get_breaker_states():
+    """Return the current state of every circuit breaker"""
+    return {name: breaker.state() for name, breaker in BREAKERS.items()}
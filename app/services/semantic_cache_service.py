@@ -0,0 +1,138 @@
+import re
+import time
+import threading
+import concurrent.futures
+import numpy as np
+import openai
+from app.config import Config
+from app.services.rate_limit_service import PRIORITY_BACKGROUND, openai_request
+from app.utils import timer_decorator, logger
+
+# Cached answers, oldest first, with their unit-length question embeddings as rows of a matrix
+SEMANTIC_CACHE = []
+SEMANTIC_MATRIX = None
+SEMANTIC_LOCK = threading.Lock()
+
+# Cache fills embed the question off the request path
+SEMANTIC_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+# Answers still being embedded, with any audio rendered for them in the meantime
+PENDING_AUDIO = {}
+
+# Words that don't change what is being asked
+FILLER_WORDS = {'um', 'uh', 'hi', 'hello', 'hey', 'please', 'so', 'yeah', 'okay', 'ok', 'well', 'like', 'just', 'thanks'}
+
+def normalize_question(text):
+    """Lowercase, strip punctuation and filler so trivially different phrasings match exactly"""
+    text = re.sub(r"[^\w\s]", " ", (text or "").lower())
+    return " ".join(word for word in text.split() if word not in FILLER_WORDS)
+
+def is_cacheable_question(message):
+    """Questions carrying phone numbers, appointment IDs or similar are never cached"""
+    return Config.SEMANTIC_CACHE_ENABLED and bool(normalize_question(message)) and not re.search(r"\d{4,}", message)
+
+@timer_decorator
+def embed_question(question, deadline=None, priority=PRIORITY_BACKGROUND):
+    """Unit-length embedding of a normalized question"""
+    response = openai_request(
+        'embeddings',
+        openai.embeddings.create,
+        model=Config.SEMANTIC_CACHE_EMBEDDING_MODEL,
+        input=question,
+        priority=priority,
+        deadline=deadline,
+        estimated_tokens=len(question) // 4 + 1
+    )
+    vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+def _prune_expired(now):
+    """Drop expired entries and rebuild the similarity matrix; call with the lock held"""
+    global SEMANTIC_MATRIX
+    live = [entry for entry in SEMANTIC_CACHE if entry["expires_at"] > now]
+    if len(live) != len(SEMANTIC_CACHE) or (SEMANTIC_MATRIX is None and live):
+        SEMANTIC_CACHE[:] = live
+        SEMANTIC_MATRIX = np.vstack([entry["embedding"] for entry in live]) if live else None
+
+def lookup_answer(message, deadline=None, priority=PRIORITY_BACKGROUND):
+    """Find a cached answer to the same or a nearby question
+
+    Returns (entry, embedding); the embedding is None when no lookup
+    needed one and is reused when the answer is stored.
+    """
+    question = normalize_question(message)
+    now = time.time()
+    with SEMANTIC_LOCK:
+        _prune_expired(now)
+        for entry in SEMANTIC_CACHE:
+            if entry["question"] == question:
+                logger.info(f"Semantic cache exact hit for: {question}")
+                return entry, None
+        if SEMANTIC_MATRIX is None:
+            return None, None
+
+    try:
+        embedding = embed_question(question, deadline, priority)
+    except Exception as e:
+        logger.error(f"Error embedding question: {str(e)}")
+        return None, None
+
+    with SEMANTIC_LOCK:
+        if SEMANTIC_MATRIX is None:
+            return None, embedding
+        scores = SEMANTIC_MATRIX @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < Config.SEMANTIC_CACHE_THRESHOLD:
+            return None, embedding
+        entry = SEMANTIC_CACHE[best]
+
+    logger.info(f"Semantic cache hit ({scores[best]:.3f}) for: {question} -> {entry['question']}")
+    return entry, embedding
+
+def _store(question, answer, embedding):
+    global SEMANTIC_MATRIX
+    try:
+        if embedding is None:
+            embedding = embed_question(question)
+    except Exception as e:
+        logger.error(f"Error embedding question: {str(e)}")
+        with SEMANTIC_LOCK:
+            PENDING_AUDIO.pop(answer, None)
+        return
+
+    with SEMANTIC_LOCK:
+        SEMANTIC_CACHE.append({
+            "question": question,
+            "answer": answer,
+            "embedding": embedding,
+            "audio": PENDING_AUDIO.pop(answer, {}),
+            "expires_at": time.time() + Config.SEMANTIC_CACHE_TTL_SECONDS
+        })
+        del SEMANTIC_CACHE[:-Config.SEMANTIC_CACHE_MAX_ENTRIES]
+        SEMANTIC_MATRIX = np.vstack([entry["embedding"] for entry in SEMANTIC_CACHE])
+
+def store_answer(message, answer, embedding=None):
+    """Cache an answer in the background, embedding the question if the lookup didn't"""
+    with SEMANTIC_LOCK:
+        PENDING_AUDIO.setdefault(answer, {})
+    SEMANTIC_EXECUTOR.submit(_store, normalize_question(message), answer, embedding)
+
+def get_cached_audio(answer, voice):
+    """Pre-rendered audio segments stored with a cached answer, if any"""
+    with SEMANTIC_LOCK:
+        for entry in SEMANTIC_CACHE:
+            if entry["answer"] == answer and voice in entry["audio"]:
+                return entry["audio"][voice]
+    return None
+
+def attach_audio(answer, voice, segments):
+    """Remember the rendered audio for every cached entry with this answer
+    
+    Audio rendered before the entry is stored is held until it is.
+    """
+    with SEMANTIC_LOCK:
+        if answer in PENDING_AUDIO:
+            PENDING_AUDIO[answer][voice] = segments
+        for entry in SEMANTIC_CACHE:
+            if entry["answer"] == answer:
+                entry["audio"][voice] = segments
@@ -54,3 +54,47 @@ def create_appointment(customer_id, service_id, start_time, end_time, notes=None
         "end_time": end_time,
         "notes": notes
     }
+
+@timer_decorator
+def find_customer_by_phone(phone_number):
+    """Look up a customer record by phone number"""
+    # This is a simplified version for initial setup
+    # In a real implementation, this would call ServiceTitan's API
+    if not phone_number:
+        return None
+    return {
+        "id": "customer_123",
+        "name": "Jane Doe",
+        "phone": phone_number,
+        "address": "123 Main St"
+    }
+
+@timer_decorator
+def get_customer_jobs(customer_id):
+    """Get open jobs for a customer"""
+    # This is a simplified version for initial setup
+    # In a real implementation, this would call ServiceTitan's API
+    return [
+        {
+            "id": "job_456",
+            "customer_id": customer_id,
+            "type": "Spring Replacement",
+            "status": "scheduled"
+        }
+    ]
+
+@timer_decorator
+def get_customer_appointments(customer_id):
+    """Get upcoming appointments for a customer"""
+    # This is a simplified version for initial setup
+    # In a real implementation, this would call ServiceTitan's API
+    return [
+        {
+            "id": "appointment_123",
+            "job_id": "job_456",
+            "status": "scheduled",
+            "technician": "John Smith",
+            "start": "2025-04-24T09:00:00",
+            "end": "2025-04-24T11:00:00"
+        }
+    ]
@@ -0,0 +1,163 @@
+import re
+import time
+import threading
+import concurrent.futures
+from app.config import Config
+from app.services.resilience_service import Deadline
+from app.utils import logger, run_with_call_sid
+
+# Speculative runs keyed by CallSid
+SPECULATION_STORE = {}
+SPECULATION_LOCK = threading.Lock()
+
+# (CallSid, turn) pairs whose final result has arrived, so late partials are ignored
+FINALIZED_TURNS = {}
+
+# Counters used to tune the hit/waste trade-off
+SPECULATION_STATS = {
+    "partials": 0,
+    "launched": 0,
+    "finals": 0,
+    "hits": 0,
+    "misses": 0,
+    "wasted": 0,
+    "saved_ms": 0.0
+}
+
+# Drop speculation state for calls that hung up without a final result
+SPECULATION_MAX_AGE = 600
+
+SPECULATION_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+def normalize_transcript(text):
+    """Normalize a transcript so partial and final results can be compared"""
+    text = re.sub(r"[^\w\s']", " ", (text or "").lower())
+    return " ".join(text.split())
+
+def _discard(entry):
+    """Cancel a speculative run that will not be used, stopping it mid-flight if it started"""
+    future = entry.get('future')
+    if future is None:
+        return
+    future.cancel()
+    entry['deadline'].cancel()
+    entry['future'] = None
+    SPECULATION_STATS["wasted"] += 1
+
+def _prune_stale(now):
+    """Forget speculation for calls that never produced a final result"""
+    for call_sid in [k for k, v in SPECULATION_STORE.items() if now - v['updated_at'] > SPECULATION_MAX_AGE]:
+        entry = SPECULATION_STORE.pop(call_sid)
+        if entry.get('timer'):
+            entry['timer'].cancel()
+        _discard(entry)
+    for key in [k for k, finalized_at in FINALIZED_TURNS.items() if now - finalized_at > SPECULATION_MAX_AGE]:
+        del FINALIZED_TURNS[key]
+
+def _launch_if_stable(call_sid, text, work_fn):
+    """Start the speculative run if the partial transcript has not changed"""
+    with SPECULATION_LOCK:
+        entry = SPECULATION_STORE.get(call_sid)
+        if not entry or entry['text'] != text or entry.get('launched_text') == text:
+            return
+
+        _discard(entry)
+        entry['launched_text'] = text
+        entry['started_at'] = time.time()
+        entry['deadline'] = Deadline(Config.VOICE_TURN_BUDGET)
+        entry['future'] = SPECULATION_EXECUTOR.submit(run_with_call_sid, call_sid, work_fn, entry['raw_text'], entry['deadline'])
+        SPECULATION_STATS["launched"] += 1
+
+    logger.info(f"Speculative run started for {call_sid}: {text}")
+
+def observe_partial(call_sid, transcript, work_fn, turn=None):
+    """Record a partial speech result and schedule a speculative run once it stabilizes
+
+    work_fn is called with the partial transcript and a Deadline that is
+    cancelled if the run is discarded; its return value is handed back to
+    the caller of claim_speculation on a hit. turn identifies the gather
+    the partial belongs to.
+    """
+    text = normalize_transcript(transcript)
+    if not call_sid or not text:
+        return
+
+    now = time.time()
+    with SPECULATION_LOCK:
+        SPECULATION_STATS["partials"] += 1
+        _prune_stale(now)
+
+        # Partials can arrive after the final result of their turn
+        if (call_sid, turn) in FINALIZED_TURNS:
+            return
+
+        entry = SPECULATION_STORE.get(call_sid)
+        if entry is not None and entry['turn'] != turn:
+            if entry.get('timer'):
+                entry['timer'].cancel()
+            _discard(entry)
+            entry = None
+        if entry is None:
+            entry = SPECULATION_STORE[call_sid] = {'turn': turn}
+        entry['updated_at'] = now
+        if entry.get('text') == text:
+            return
+
+        # The transcript moved on, so any run on the old text is wasted
+        if entry.get('launched_text') and entry['launched_text'] != text:
+            _discard(entry)
+            entry['launched_text'] = None
+
+        entry['text'] = text
+        entry['raw_text'] = transcript
+        if entry.get('timer'):
+            entry['timer'].cancel()
+
+        if len(text.split()) < Config.SPECULATION_MIN_WORDS:
+            entry['timer'] = None
+            return
+
+        timer = threading.Timer(Config.SPECULATION_STABLE_MS / 1000.0, _launch_if_stable, args=(call_sid, text, work_fn))
+        timer.daemon = True
+        entry['timer'] = timer
+        timer.start()
+
+def claim_speculation(call_sid, final_transcript, turn=None):
+    """Return the speculative future if it matches the final transcript, otherwise cancel it"""
+    with SPECULATION_LOCK:
+        FINALIZED_TURNS[(call_sid, turn)] = time.time()
+        entry = SPECULATION_STORE.pop(call_sid, None)
+        if entry is None:
+            return None
+        if entry['turn'] != turn:
+            if entry.get('timer'):
+                entry['timer'].cancel()
+            _discard(entry)
+            return None
+
+        SPECULATION_STATS["finals"] += 1
+        if entry.get('timer'):
+            entry['timer'].cancel()
+
+        future = entry.get('future')
+        if future is not None and entry.get('launched_text') == normalize_transcript(final_transcript):
+            SPECULATION_STATS["hits"] += 1
+            SPECULATION_STATS["saved_ms"] += (time.time() - entry['started_at']) * 1000
+            logger.info(f"Speculation hit for {call_sid}")
+            return future
+
+        SPECULATION_STATS["misses"] += 1
+        _discard(entry)
+
+    logger.info(f"Speculation miss for {call_sid}")
+    return None
+
+def get_speculation_stats():
+    """Return speculation counters along with hit and waste rates"""
+    with SPECULATION_LOCK:
+        stats = dict(SPECULATION_STATS)
+
+    stats["hit_rate"] = stats["hits"] / stats["finals"] if stats["finals"] else 0.0
+    stats["waste_rate"] = stats["wasted"] / stats["launched"] if stats["launched"] else 0.0
+    stats["avg_saved_ms"] = stats["saved_ms"] / stats["hits"] if stats["hits"] else 0.0
+    return stats
@@ -1,28 +1,69 @@
 import os
 import boto3
-from botocore.exceptions import NoCredentialsError
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError, NoCredentialsError
 from app.config import Config
+from app.services.resilience_service import BREAKERS, request_timeout
 from app.utils import timer_decorator, logger
 
+def get_s3_url(s3_file_name):
+    """Public URL of an object in the TTS bucket"""
+    bucket_name = os.getenv('AWS_S3_BUCKET', 'kooler-agent-tts')
+    return f"https://{bucket_name}.s3.amazonaws.com/{s3_file_name}"
+
+def get_s3_client(deadline=None):
+    """S3 client, bounded by the caller's remaining budget when one is given"""
+    client_config = None
+    if deadline is not None:
+        timeout = max(request_timeout(deadline), 1)
+        client_config = BotoConfig(connect_timeout=timeout, read_timeout=timeout, retries={'max_attempts': 1})
+    
+    return boto3.client('s3', 
+                     region_name=os.getenv('AWS_REGION', 'us-west-2'),
+                     aws_access_key_id=os.getenv('AWS_ACCESS_KEY'),
+                     aws_secret_access_key=os.getenv('AWS_SECRET_KEY'),
+                     config=client_config)
+
 @timer_decorator
-def upload_to_s3(local_file, s3_file_name=None):
+def upload_to_s3(local_file, s3_file_name=None, deadline=None):
     """Upload a file to S3 and return its public URL"""
     if s3_file_name is None:
         s3_file_name = os.path.basename(local_file)
     
     bucket_name = os.getenv('AWS_S3_BUCKET', 'kooler-agent-tts')
     
-    s3 = boto3.client('s3', 
-                     region_name=os.getenv('AWS_REGION', 'us-west-2'),
-                     aws_access_key_id=os.getenv('AWS_ACCESS_KEY'),
-                     aws_secret_access_key=os.getenv('AWS_SECRET_KEY'))
+    s3 = get_s3_client(deadline)
     try:
-        s3.upload_file(local_file, bucket_name, s3_file_name)
+        BREAKERS['s3'].call(s3.upload_file, local_file, bucket_name, s3_file_name)
         logger.info(f"File uploaded to S3: {s3_file_name}")
-        return f"https://{bucket_name}.s3.amazonaws.com/{s3_file_name}"
+        return get_s3_url(s3_file_name)
     except NoCredentialsError:
         logger.error("AWS credentials not available") 
         return None
     except Exception as e:
         logger.error(f"Error uploading to S3: {str(e)}")
         return None
+
+@timer_decorator
+def s3_object_exists(s3_file_name, deadline=None):
+    """Check whether an object has already been uploaded to the bucket"""
+    bucket_name = os.getenv('AWS_S3_BUCKET', 'kooler-agent-tts')
+    
+    s3 = get_s3_client(deadline)
+    
+    def head_object():
+        # A missing object is an answer, not an upstream failure; without
+        # s3:ListBucket S3 reports a missing key as 403 rather than 404
+        try:
+            s3.head_object(Bucket=bucket_name, Key=s3_file_name)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound', '403', 'Forbidden', 'AccessDenied'):
+                return False
+            raise
+    
+    try:
+        return BREAKERS['s3'].call(head_object)
+    except Exception as e:
+        logger.error(f"Error checking S3 object: {str(e)}")
+        return False
@@ -0,0 +1,169 @@
+import io
+import os
+import re
+import time
+import concurrent.futures
+from functools import partial
+import openai
+from pydub import AudioSegment
+from pydub.silence import detect_nonsilent
+from pydub.utils import which
+from app.config import Config
+from app.services.rate_limit_service import PRIORITY_SMS, openai_request
+from app.utils import timer_decorator, logger
+
+# Longest run of words looked for when removing text repeated across an overlap
+MAX_OVERLAP_WORDS = 12
+
+# Segments are uploaded as low-bitrate MP3 when ffmpeg is installed to encode them
+SEGMENT_FORMAT = "mp3" if which("ffmpeg") or which("avconv") else "wav"
+SEGMENT_BITRATE = "32k"
+
+def prepare_speech_audio(audio):
+    """Downsample to speech-grade mono, which is all Whisper needs"""
+    return audio.set_channels(1).set_frame_rate(Config.TRANSCRIPTION_SAMPLE_RATE).set_sample_width(2)
+
+def plan_segments(audio, max_segment_ms=None, overlap_ms=None):
+    """Split audio at silences into segments of at most max_segment_ms
+
+    Returns (start_ms, end_ms, overlaps_previous) tuples. Segments cut
+    inside a silence are padded only into that silence; segments that had
+    to be cut mid-speech overlap their neighbours by overlap_ms so no word
+    is lost, and are flagged so the merge removes the repeated words.
+    """
+    max_segment_ms = max_segment_ms or Config.TRANSCRIPTION_SEGMENT_MS
+    overlap_ms = Config.TRANSCRIPTION_OVERLAP_MS if overlap_ms is None else overlap_ms
+    total_ms = len(audio)
+    if total_ms <= max_segment_ms:
+        return [(0, total_ms, False)]
+
+    speech = detect_nonsilent(
+        audio,
+        min_silence_len=Config.TRANSCRIPTION_MIN_SILENCE_MS,
+        silence_thresh=audio.dBFS - Config.TRANSCRIPTION_SILENCE_DB
+    )
+    # Candidate cuts are silence midpoints, each with how far it may be padded
+    cuts = [((prev_end + start) // 2, (start - prev_end) // 2) for (_, prev_end), (start, _) in zip(speech, speech[1:])]
+
+    bounds = []
+    segment_start, start_pad, mid_speech = 0, 0, False
+    while total_ms - segment_start > max_segment_ms:
+        limit = segment_start + max_segment_ms - overlap_ms
+        candidates = [cut for cut in cuts if segment_start + max_segment_ms // 4 < cut[0] <= limit]
+        cut, pad = candidates[-1] if candidates else (limit, overlap_ms)
+        pad = min(pad, overlap_ms)
+        bounds.append((max(0, segment_start - start_pad), cut + pad, mid_speech))
+        segment_start, start_pad, mid_speech = cut, pad, not candidates
+    bounds.append((max(0, segment_start - start_pad), total_ms, mid_speech))
+    return bounds
+
+def _words(text):
+    return [re.sub(r"[^\w']", "", word.lower()) for word in text.split()]
+
+def merge_transcripts(texts, overlapped=None):
+    """Join segment transcripts in order, dropping words repeated across overlaps
+
+    overlapped[i] says whether segment i shares speech with segment i - 1;
+    when omitted every boundary is checked.
+    """
+    merged = []
+    for i, text in enumerate(texts):
+        words = text.split()
+        if not words:
+            continue
+
+        overlap = 0
+        if overlapped is None or overlapped[i]:
+            previous, current = _words(" ".join(merged[-MAX_OVERLAP_WORDS:])), _words(text)
+            for size in range(min(len(previous), len(current)), 0, -1):
+                if previous[-size:] == current[:size]:
+                    overlap = size
+                    break
+        merged.extend(words[overlap:])
+    return " ".join(merged)
+
+def transcribe_with_whisper(audio, start_ms, end_ms, deadline=None, priority=PRIORITY_SMS):
+    """Transcribe one segment with whisper-1"""
+    buffer = io.BytesIO()
+    if SEGMENT_FORMAT == "mp3":
+        audio.export(buffer, format="mp3", bitrate=SEGMENT_BITRATE)
+    else:
+        audio.export(buffer, format="wav")
+    transcript = openai_request(
+        'whisper',
+        openai.audio.transcriptions.create,
+        model="whisper-1",
+        file=(f"segment-{start_ms}.{SEGMENT_FORMAT}", buffer.getvalue()),
+        priority=priority,
+        deadline=deadline
+    )
+    return transcript.text
+
+def transcribe_file_with_whisper(path, deadline=None, priority=PRIORITY_SMS):
+    """Transcribe a whole file with whisper-1, uploading it as received"""
+    with open(path, "rb") as audio_file:
+        content = audio_file.read()
+    transcript = openai_request(
+        'whisper',
+        openai.audio.transcriptions.create,
+        model="whisper-1",
+        file=(os.path.basename(path), content),
+        priority=priority,
+        deadline=deadline
+    )
+    return transcript.text
+
+class FakeTranscriber:
+    """Offline stand-in for Whisper, for testing and benchmarking segmentation
+
+    Built from (word, time_ms) pairs, it returns the words spoken inside
+    each segment after a simulated latency of latency seconds per request
+    plus realtime_factor seconds per second of audio.
+    """
+
+    def __init__(self, timed_words, latency=0.0, realtime_factor=0.0):
+        self.timed_words = timed_words
+        self.latency = latency
+        self.realtime_factor = realtime_factor
+        self.calls = 0
+
+    def __call__(self, audio, start_ms, end_ms):
+        self.calls += 1
+        delay = self.latency + self.realtime_factor * (end_ms - start_ms) / 1000.0
+        if delay:
+            time.sleep(delay)
+        return " ".join(word for word, at_ms in self.timed_words if start_ms <= at_ms < end_ms)
+
+@timer_decorator
+def transcribe_audio(audio, transcriber=None, deadline=None, max_workers=None):
+    """Transcribe audio by splitting it on silence and transcribing the segments concurrently"""
+    transcriber = transcriber or partial(transcribe_with_whisper, deadline=deadline)
+    audio = prepare_speech_audio(audio)
+    bounds = plan_segments(audio)
+    logger.info(f"Transcribing {len(audio)} ms of audio in {len(bounds)} segments")
+
+    if len(bounds) == 1:
+        return transcriber(audio, 0, len(audio))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or Config.TRANSCRIPTION_WORKERS) as executor:
+        futures = [executor.submit(transcriber, audio[start:end], start, end) for start, end, _ in bounds]
+        texts = [future.result() for future in futures]
+
+    return merge_transcripts(texts, [overlaps for _, _, overlaps in bounds])
+
+def transcribe_audio_file(path, transcriber=None, deadline=None):
+    """Transcribe an audio file, splitting it only when it is long enough to benefit
+
+    Decoding Twilio's mp3/amr media needs an ffmpeg binary on the host.
+    Without one, and for memos that fit in a single segment, the original
+    compressed file is uploaded to Whisper in one request.
+    """
+    try:
+        audio = AudioSegment.from_file(path)
+    except Exception as e:
+        logger.warning(f"Couldn't decode audio for segmenting, transcribing it whole: {str(e)}")
+        return transcribe_file_with_whisper(path, deadline)
+
+    if transcriber is None and len(audio) <= Config.TRANSCRIPTION_SEGMENT_MS:
+        return transcribe_file_with_whisper(path, deadline)
+    return transcribe_audio(audio, transcriber, deadline)
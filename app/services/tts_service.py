@@ -1,8 +1,14 @@
 import os
+import time
+import fcntl
 import tempfile
 import hashlib
+import threading
+import concurrent.futures
 import openai
 from app.config import Config
+from app.services.resilience_service import BREAKERS, DeadlineExceeded, request_timeout
+from app.services.rate_limit_service import PRIORITY_BACKGROUND, openai_request
 from app.utils import timer_decorator, logger
 
 # Initialize OpenAI client
@@ -11,8 +17,41 @@ openai.api_key = Config.OPENAI_API_KEY
 # Simple cache for TTS responses
 TTS_CACHE = {}
 
+# Cache keys of phrases rendered ahead of time for the degraded path
+PRERENDERED_TTS = set()
+
+# Renders in progress in this worker, keyed by cache key
+TTS_INFLIGHT = {}
+TTS_INFLIGHT_LOCK = threading.Lock()
+
+# Recent render failures, keyed by cache key with the time they expire
+TTS_FAILURES = {}
+
+# Lock and failure marker files shared by all workers on this host
+TTS_LOCK_DIR = os.path.join(tempfile.gettempdir(), 'kooler-tts-locks')
+os.makedirs(TTS_LOCK_DIR, exist_ok=True)
+
+def get_tts_cache_key(text, voice="nova"):
+    """Cache key for a rendered phrase, also used as its S3 object name"""
+    return hashlib.md5(f"{text}:{voice}".encode()).hexdigest()
+
+def register_prerendered_tts(texts, voice="nova"):
+    """Mark phrases whose audio is already uploaded so they can be served while TTS is down"""
+    for text in texts:
+        PRERENDERED_TTS.add(get_tts_cache_key(text, voice))
+
+def get_prerendered_tts(text, voice="nova"):
+    """Return cached or pre-rendered audio without calling any upstream"""
+    cache_key = get_tts_cache_key(text, voice)
+    if cache_key in TTS_CACHE:
+        return TTS_CACHE[cache_key]
+    if cache_key in PRERENDERED_TTS:
+        from app.services.storage_service import get_s3_url
+        return get_s3_url(f"tts-{cache_key}.mp3")
+    return None
+
 @timer_decorator
-def text_to_speech(text, voice="nova"):
+def text_to_speech(text, voice="nova", deadline=None, priority=PRIORITY_BACKGROUND):
     """Convert text to speech using OpenAI's TTS API
     
     Available voices:
@@ -22,6 +61,9 @@ def text_to_speech(text, voice="nova"):
     - onyx: Deep and authoritative (male voice)
     - nova: Professional and smooth (female voice)
     - shimmer: Bright and optimistic
+    
+    Returns None when the upstream fails; raises DeadlineExceeded when the
+    caller's budget ran out or was cancelled, which says nothing about the phrase.
     """
     try:
         # Create a temporary file to store the audio
@@ -30,10 +72,14 @@ def text_to_speech(text, voice="nova"):
         temp_file.close()
         
         # Generate speech using OpenAI TTS
-        response = openai.audio.speech.create(
+        response = openai_request(
+            'tts',
+            openai.audio.speech.create,
             model="tts-1-hd",  # Using the high-definition model for best quality
             voice=voice,
-            input=text
+            input=text,
+            priority=priority,
+            deadline=deadline
         )
         
         # Save the audio to the temporary file
@@ -41,36 +87,179 @@ def text_to_speech(text, voice="nova"):
         
         logger.info(f"Generated speech saved to {temp_filename}")
         return temp_filename
+    except DeadlineExceeded:
+        os.remove(temp_filename)
+        raise
     except Exception as e:
         logger.error(f"Error generating speech: {str(e)}")
         return None
 
+def marker_expired(marker, now):
+    """Check a failure marker's age, removing it once it has expired"""
+    try:
+        if now - os.path.getmtime(marker) < Config.TTS_NEGATIVE_CACHE_SECONDS:
+            return False
+        os.remove(marker)
+    except OSError:
+        pass
+    return True
+
+def recently_failed(cache_key):
+    """Check the negative cache in this worker and in the shared marker files"""
+    expires_at = TTS_FAILURES.get(cache_key)
+    if expires_at and expires_at > time.time():
+        return True
+    
+    return not marker_expired(os.path.join(TTS_LOCK_DIR, f"{cache_key}.failed"), time.time())
+
+def prune_failures(now):
+    """Forget expired failures, including marker files for phrases never asked for again"""
+    for cache_key in [k for k, expires_at in list(TTS_FAILURES.items()) if expires_at <= now]:
+        TTS_FAILURES.pop(cache_key, None)
+    try:
+        markers = [name for name in os.listdir(TTS_LOCK_DIR) if name.endswith('.failed')]
+    except OSError:
+        return
+    for name in markers:
+        marker_expired(os.path.join(TTS_LOCK_DIR, name), now)
+
+def record_failure(cache_key):
+    """Negatively cache a failed render so callers don't pile retries onto an outage"""
+    now = time.time()
+    prune_failures(now)
+    TTS_FAILURES[cache_key] = now + Config.TTS_NEGATIVE_CACHE_SECONDS
+    try:
+        with open(os.path.join(TTS_LOCK_DIR, f"{cache_key}.failed"), 'w'):
+            pass
+    except OSError as e:
+        logger.error(f"Error writing TTS failure marker: {str(e)}")
+
+def acquire_render_lock(cache_key, deadline=None):
+    """Take the cross-worker render lock for a cache key
+    
+    Returns (lock_file, contended); lock_file is None if the lock can't be
+    had in time. Lock files are removed on release, so a lock won on a file
+    that has since been unlinked is retried on the current one.
+    """
+    path = os.path.join(TTS_LOCK_DIR, f"{cache_key}.lock")
+    wait_until = time.time() + request_timeout(deadline, cap=Config.TTS_RENDER_LOCK_SECONDS)
+    contended = False
+    while True:
+        lock_file = open(path, 'a')
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                contended = True
+                if time.time() >= wait_until:
+                    lock_file.close()
+                    return None, contended
+                time.sleep(0.05)
+        
+        try:
+            if os.fstat(lock_file.fileno()).st_ino == os.stat(path).st_ino:
+                return lock_file, contended
+        except FileNotFoundError:
+            pass
+        # The previous holder removed this file when it released it
+        contended = True
+        lock_file.close()
+
+def release_render_lock(cache_key, lock_file):
+    """Remove the lock file and release it, so finished phrases leave nothing behind"""
+    try:
+        os.remove(os.path.join(TTS_LOCK_DIR, f"{cache_key}.lock"))
+    except OSError:
+        pass
+    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    lock_file.close()
+
+def render_and_upload(text, voice, cache_key, deadline=None, priority=PRIORITY_BACKGROUND):
+    """Render a phrase and upload it, once across all workers on this host"""
+    # Import here to avoid circular imports
+    from app.services.storage_service import get_s3_url, s3_object_exists, upload_to_s3
+    
+    s3_file_name = f"tts-{cache_key}.mp3"
+    lock_file, contended = acquire_render_lock(cache_key, deadline)
+    if lock_file is None:
+        logger.info(f"Timed out waiting for another worker to render: {text[:30]}...")
+        return None
+    
+    try:
+        # Another worker may have finished or failed this render while we waited
+        if contended:
+            if recently_failed(cache_key):
+                return None
+            if s3_object_exists(s3_file_name, deadline):
+                return get_s3_url(s3_file_name)
+        
+        speech_file = text_to_speech(text, voice, deadline, priority)
+        if not speech_file:
+            record_failure(cache_key)
+            return None
+        
+        s3_url = upload_to_s3(speech_file, s3_file_name, deadline)
+        # Clean up the temp file
+        os.remove(speech_file)
+        # An upload cut short by the caller's budget isn't the phrase's fault
+        if not s3_url and not (deadline is not None and deadline.expired()):
+            record_failure(cache_key)
+        return s3_url
+    finally:
+        release_render_lock(cache_key, lock_file)
+
 @timer_decorator
-def get_cached_tts(text, voice="nova"):
+def get_cached_tts(text, voice="nova", deadline=None, priority=PRIORITY_BACKGROUND):
     """Get cached TTS or generate new"""
     # Create a cache key based on text and voice
-    cache_key = hashlib.md5(f"{text}:{voice}".encode()).hexdigest()
+    cache_key = get_tts_cache_key(text, voice)
     
     # Check if we have a cached S3 URL
     if cache_key in TTS_CACHE:
         logger.info(f"Using cached TTS for: {text[:30]}...")
         return TTS_CACHE[cache_key]
     
-    # Generate new TTS
-    speech_file = text_to_speech(text, voice)
-    if not speech_file:
-        return None
+    # Serve pre-rendered audio only while an upstream is tripped or the budget is spent
+    if BREAKERS['tts'].state() == "open" or BREAKERS['s3'].state() == "open" or (deadline is not None and deadline.expired()):
+        logger.info(f"TTS degraded, using pre-rendered audio for: {text[:30]}...")
+        return get_prerendered_tts(text, voice)
     
-    # Upload to S3 (import here to avoid circular imports)
-    from app.services.storage_service import upload_to_s3
-    s3_url = upload_to_s3(speech_file, f"tts-{cache_key}.mp3")
+    # Don't retry a phrase that just failed to render
+    if recently_failed(cache_key):
+        logger.info(f"TTS recently failed, using pre-rendered audio for: {text[:30]}...")
+        return get_prerendered_tts(text, voice)
     
-    if s3_url:
-        # Cache the S3 URL
-        TTS_CACHE[cache_key] = s3_url
-        # Clean up the temp file
-        os.remove(speech_file)
+    # Join a render of the same phrase already in progress in this worker
+    with TTS_INFLIGHT_LOCK:
+        future = TTS_INFLIGHT.get(cache_key)
+        is_leader = future is None
+        if is_leader:
+            future = concurrent.futures.Future()
+            TTS_INFLIGHT[cache_key] = future
     
-    return s3_url
-
-
+    if not is_leader:
+        try:
+            s3_url = future.result(timeout=request_timeout(deadline, cap=Config.TTS_RENDER_LOCK_SECONDS))
+        except concurrent.futures.TimeoutError:
+            s3_url = None
+        return s3_url or get_prerendered_tts(text, voice)
+    
+    s3_url = None
+    try:
+        s3_url = render_and_upload(text, voice, cache_key, deadline, priority)
+        if s3_url:
+            # Cache the S3 URL
+            TTS_CACHE[cache_key] = s3_url
+    except DeadlineExceeded as e:
+        # Out of budget or cancelled; another caller may still render this phrase
+        logger.info(f"TTS render abandoned: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error rendering TTS: {str(e)}")
+        record_failure(cache_key)
+    finally:
+        with TTS_INFLIGHT_LOCK:
+            TTS_INFLIGHT.pop(cache_key, None)
+        future.set_result(s3_url)
+    
+    return s3_url or get_prerendered_tts(text, voice)
@@ -1,6 +1,8 @@
 import time
 import logging
 import json
+import threading
+import contextvars
 from functools import wraps
 
 # Set up logging
@@ -10,16 +12,56 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# CallSid of the call the current request or background job is working on
+CURRENT_CALL_SID = contextvars.ContextVar('current_call_sid', default=None)
+
+# CallSid bound to each thread, so the sampler can attribute stacks to calls
+THREAD_CALLS = {}
+
+def get_call_sid():
+    """Return the CallSid bound to the current context, if any"""
+    return CURRENT_CALL_SID.get()
+
+def _bind_thread(call_sid):
+    if call_sid:
+        THREAD_CALLS[threading.get_ident()] = call_sid
+    else:
+        THREAD_CALLS.pop(threading.get_ident(), None)
+
+def bind_call_sid(call_sid):
+    """Bind a CallSid to the current context and thread"""
+    _bind_thread(call_sid)
+    return CURRENT_CALL_SID.set(call_sid)
+
+def run_with_call_sid(call_sid, func, *args, **kwargs):
+    """Run func with call_sid bound, for work handed off to other threads"""
+    previous = CURRENT_CALL_SID.get()
+    token = bind_call_sid(call_sid)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        CURRENT_CALL_SID.reset(token)
+        _bind_thread(previous)
+
 def timer_decorator(func):
     """Decorator to measure function execution time for latency monitoring"""
     @wraps(func)
     def wrapper(*args, **kwargs):
         start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        execution_time = (end_time - start_time) * 1000  # Convert to ms
-        logger.info(f"Function {func.__name__} executed in {execution_time:.2f} ms")
-        return result
+        try:
+            return func(*args, **kwargs)
+        finally:
+            end_time = time.time()
+            execution_time = (end_time - start_time) * 1000  # Convert to ms
+            call_sid = get_call_sid()
+            if call_sid:
+                logger.info(f"Function {func.__name__} executed in {execution_time:.2f} ms [{call_sid}]")
+            else:
+                logger.info(f"Function {func.__name__} executed in {execution_time:.2f} ms")
+            
+            # Import here to avoid circular imports
+            from app.services.profiling_service import record_span
+            record_span(func.__name__, start_time, end_time)
     return wrapper
 
 def safe_json_loads(json_str, default=None):
@@ -0,0 +1,34 @@
+import os
+import sys
+import time
+import random
+from pydub import AudioSegment
+from pydub.generators import Sine
+
+# Set up environment for imports to work
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.transcription_service import FakeTranscriber, transcribe_audio
+
+# Build a synthetic memo: each word is a short tone, sentences end in a pause
+random.seed(7)
+audio = AudioSegment.silent(duration=300)
+timed_words = []
+for sentence in range(60):
+    for word in range(random.randint(5, 14)):
+        timed_words.append((f"w{len(timed_words)}", len(audio) + 100))
+        audio += Sine(220 + 20 * (word % 5)).to_audio_segment(duration=220, volume=-12)
+        audio += AudioSegment.silent(duration=80)
+    audio += AudioSegment.silent(duration=random.choice([150, 700]))
+
+expected = " ".join(word for word, _ in timed_words)
+print(f"Memo length: {len(audio) / 1000:.1f}s, {len(timed_words)} words")
+
+# Whisper-like latency: fixed request overhead plus time proportional to audio length
+for workers in (1, 4):
+    transcriber = FakeTranscriber(timed_words, latency=0.3, realtime_factor=0.02)
+    start_time = time.time()
+    text = transcribe_audio(audio, transcriber=transcriber, max_workers=workers)
+    elapsed = time.time() - start_time
+    status = "ok" if text == expected else "MISMATCH"
+    print(f"workers={workers}: {elapsed:.2f}s over {transcriber.calls} segments, transcript {status}")
@@ -19,3 +19,14 @@ if speech_file:
     print("Done! Use this URL in your Twilio routes.")
 else:
     print("Failed to generate greeting audio.")
+
+# Pre-render the degraded answers played while TTS or S3 is unavailable
+from app.services.assistant_service import FALLBACK_RESPONSES
+from app.services.tts_service import get_cached_tts
+from app.routes.twilio_routes import chunk_response
+
+print("Pre-rendering fallback responses...")
+for fallback in FALLBACK_RESPONSES.values():
+    for chunk in chunk_response(fallback):
+        s3_url = get_cached_tts(chunk, voice="nova")
+        print(f"{chunk[:40]}... -> {s3_url}")